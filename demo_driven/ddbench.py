@@ -0,0 +1,212 @@
+"""Benchmarks ddrun, ddnbo and ddcov on a generated demo directory.
+
+Usage: python -m demo_driven.ddbench [-o results.json] [--compare old.json] [options]
+
+The generated directory holds many tiny .py demos, a few demos with huge outputs, notebooks
+with many cells and nested .sh demos that call ddrun themselves, like showcase/nested.sh.
+Discovery, suppression filtering, normalization, diffing and baseline writes are timed in-process; running
+the demos is timed through the command line tools, as is the startup of ddrun on a single .py demo
+against that of the bare interpreter running it. Timings are printed to stderr as they are
+measured, and can be written as JSON to be compared with the results of another release.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+from demo_driven.ddrun import (
+    JUPYTER_AVAILABLE,
+    DEFAULT_TEXT_ENCODING,
+    PYTHON_UTF8_ENV,
+    glob_sorted,
+    match_pattern,
+    filtered_output,
+    save_output
+)
+from demo_driven.linediff import get_opcodes, make_html
+from demo_driven.normalize import BUILTIN_RULES, compile_rules
+
+if JUPYTER_AVAILABLE:
+    import nbformat
+
+DEMO_DIR = "demos"
+
+def huge_output_lines(count: int, changed_every: int = 0):
+    for i in range(count):
+        if changed_every and i % changed_every == 0:
+            yield f"{i:08d} changed\n"
+        else:
+            yield f"{i:08d} {'value':>10} {i * 7 % 1000:>6} {i * 13 % 997:>6}\n"
+        if i % 1000 == 500:  # one line per thousand is dropped by SUPPRESSED_PATTERNS
+            yield f"Assertion failed: x > 0 [{i}] (bench.c:{i})\n"
+
+def generate(root: Path, args):
+    demo_dir = root / DEMO_DIR
+    demo_dir.mkdir(parents=True)
+    for i in range(args.tiny):
+        (demo_dir / f"tiny_{i:05d}.py").write_text(f"print('tiny demo {i}')\n", encoding=DEFAULT_TEXT_ENCODING)
+    for i in range(args.huge):
+        source = f"for i in range({args.huge_lines}):\n    print(f'{{i:08d}} {{i * 7 % 1000:>6}} {{\"x\" * 60}}')\n"
+        (demo_dir / f"huge_{i}.py").write_text(source, encoding=DEFAULT_TEXT_ENCODING)
+    if JUPYTER_AVAILABLE:
+        for i in range(args.notebooks):
+            cells = [nbformat.v4.new_code_cell(f"print({n} * {n})") for n in range(args.cells)]
+            nbformat.write(nbformat.v4.new_notebook(cells=cells), demo_dir / f"cells_{i}.ipynb")
+    for i in range(args.nested):
+        nested_dir = f"{DEMO_DIR}/nested/{i}"
+        (root / nested_dir).mkdir(parents=True)
+        for n in range(3):
+            (root / nested_dir / f"inner_{n}.py").write_text(f"print('nested {i}.{n}')\n", encoding=DEFAULT_TEXT_ENCODING)
+            # saved in advance, so that the nested demos print the same on every run
+            (root / nested_dir / f"inner_{n}.py.txt").write_text(f"nested {i}.{n}\n", encoding=DEFAULT_TEXT_ENCODING)
+        (demo_dir / f"nested_{i}.sh").write_text(f"ddrun -d {nested_dir}\nddrun\nddrun -d\n", encoding=DEFAULT_TEXT_ENCODING)
+    # nested demos change .dddir while they run
+    (root / "demo_driven.ini").write_text("[parallel]\nserial = nested_*.sh\n", encoding=DEFAULT_TEXT_ENCODING)
+    (root / ".dddir").write_text(DEMO_DIR, encoding=DEFAULT_TEXT_ENCODING)
+
+def measure(results: dict, stage: str, func, repeat=1, items=None):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    results[stage] = {"seconds": min(times), "median": statistics.median(times), "repeat": repeat}
+    if items:
+        results[stage]["items"] = items
+    print(f"{stage:<24} {min(times):10.4f}s" + (f"  ({items} items)" if items else ""), file=sys.stderr, flush=True)
+
+def run_tool(root: Path, tool: str, *args):
+    subprocess.run(
+        [sys.executable, "-m", f"demo_driven.{tool}", *args],
+        cwd=root,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env=PYTHON_UTF8_ENV,
+        check=False
+    )
+
+def bench_startup(root: Path, args, results: dict):
+    startup_dir = root / "startup"
+    (startup_dir / DEMO_DIR).mkdir(parents=True)
+    (startup_dir / DEMO_DIR / "hello.py").write_text("print('hello')\n", encoding=DEFAULT_TEXT_ENCODING)
+    (startup_dir / DEMO_DIR / "hello.py.txt").write_text("hello\n", encoding=DEFAULT_TEXT_ENCODING)
+    (startup_dir / ".dddir").write_text(DEMO_DIR, encoding=DEFAULT_TEXT_ENCODING)
+    repeat = max(args.repeat, 5)
+    python = lambda: subprocess.run([sys.executable, f"{DEMO_DIR}/hello.py"], cwd=startup_dir, stdout=subprocess.DEVNULL, env=PYTHON_UTF8_ENV, check=False)
+    measure(results, "startup.python", python, repeat=repeat)
+    measure(results, "startup.ddrun", lambda: run_tool(startup_dir, "ddrun", "hello"), repeat=repeat)
+    overhead = results["startup.ddrun"]["seconds"] - results["startup.python"]["seconds"]
+    results["startup.overhead"] = {"seconds": overhead}
+    print(f"{'startup.overhead':<24} {overhead:10.4f}s", file=sys.stderr, flush=True)
+
+def bench_in_process(root: Path, args, results: dict):
+    demo_dir = root / DEMO_DIR
+    files = glob_sorted(str(demo_dir))
+    measure(results, "discovery.glob_sorted", lambda: glob_sorted(str(demo_dir)), repeat=args.repeat, items=len(files))
+    patterns = ["tiny_000*", "*.ipynb", "huge_?", "nested_*.sh", "missing"]
+    measure(results, "discovery.match_pattern", lambda: [match_pattern(p, files) for p in patterns], repeat=args.repeat, items=len(files))
+
+    lines = list(huge_output_lines(args.huge_lines))
+    measure(results, "suppression", lambda: sum(1 for _ in filtered_output(lines)), repeat=args.repeat, items=len(lines))
+    normalize = compile_rules(tuple(BUILTIN_RULES.items()))
+    measure(results, "normalization", lambda: sum(1 for _ in filtered_output(lines, normalize)), repeat=args.repeat, items=len(lines))
+
+    old = [line.rstrip("\n") for line in huge_output_lines(args.huge_lines)]
+    new = [line.rstrip("\n") for line in huge_output_lines(args.huge_lines, changed_every=997)]
+    measure(results, "diff.opcodes", lambda: get_opcodes(old, new), repeat=args.repeat, items=len(old))
+    measure(results, "diff.html", lambda: make_html(old, new, "previous", "current"), repeat=args.repeat, items=len(old))
+
+    baseline_dir = root / "baselines"
+    baseline_dir.mkdir()
+    script_file = baseline_dir / "huge.py"
+
+    def write_baseline():
+        script_file.with_name(script_file.name + ".txt").unlink(missing_ok=True)
+        save_output(script_file, huge_output_lines(args.huge_lines))
+
+    measure(results, "baseline.write", write_baseline, repeat=args.repeat, items=args.huge_lines)
+    measure(results, "baseline.compare", lambda: save_output(script_file, huge_output_lines(args.huge_lines)), repeat=args.repeat, items=args.huge_lines)
+
+def bench_tools(root: Path, args, results: dict):
+    demos = args.tiny + args.huge + args.nested + (args.notebooks if JUPYTER_AVAILABLE else 0)
+    ddrun_args = args.ddrun_args.split()
+    measure(results, "execution.ddrun_first", lambda: run_tool(root, "ddrun", *ddrun_args), items=demos)
+    measure(results, "execution.ddrun_again", lambda: run_tool(root, "ddrun", *ddrun_args), items=demos)
+    if JUPYTER_AVAILABLE and args.notebooks:
+        measure(results, "execution.ddnbo", lambda: run_tool(root, "ddnbo"), items=args.notebooks * args.cells)
+    coverage_patterns = ["tiny_0000?", "huge_0"]
+    measure(results, "execution.ddcov", lambda: run_tool(root, "ddcov", *coverage_patterns), items=11)
+
+def environment():
+    try:
+        from importlib.metadata import version
+        package_version = version("demo-driven")
+    except Exception:
+        package_version = None
+    return {
+        "demo_driven": package_version,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count()
+    }
+
+def compare(results: dict, previous: dict):
+    print(f"\n{'stage':<24} {'previous':>10} {'current':>10} {'ratio':>7}")
+    for stage, result in results.items():
+        if stage in previous:
+            before, after = previous[stage]["seconds"], result["seconds"]
+            ratio = f"{after / before:7.2f}" if before else "      -"
+            print(f"{stage:<24} {before:10.4f} {after:10.4f} {ratio}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ddrun, ddnbo and ddcov on a generated demo directory")
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file (- for stdout)")
+    parser.add_argument("--compare", metavar="FILE", help="Compare with the JSON results of an earlier benchmark")
+    parser.add_argument("--tiny", type=int, default=2000, help="Number of tiny .py demos")
+    parser.add_argument("--huge", type=int, default=2, help="Number of .py demos with huge outputs")
+    parser.add_argument("--huge-lines", type=int, default=200_000, help="Lines printed by each huge demo")
+    parser.add_argument("--notebooks", type=int, default=2, help="Number of notebooks")
+    parser.add_argument("--cells", type=int, default=200, help="Code cells per notebook")
+    parser.add_argument("--nested", type=int, default=3, help="Number of nested .sh demos that call ddrun")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions of the in-process stages; the fastest is reported")
+    parser.add_argument("--ddrun-args", default="", help="Extra arguments for the timed ddrun runs, e.g. \"-j 8\"")
+    parser.add_argument("--skip-tools", action="store_true", help="Only run the in-process stages")
+    parser.add_argument("--keep", metavar="DIR", help="Generate the demos in DIR and keep them, instead of a temporary directory")
+    args = parser.parse_args()
+
+    root = Path(args.keep) if args.keep else Path(tempfile.mkdtemp(prefix="ddbench-"))
+    if args.keep and root.exists():
+        print(f"{root}: already exists")
+        sys.exit(1)
+    results = {}
+    try:
+        start = time.perf_counter()
+        generate(root, args)
+        print(f"{'generate':<24} {time.perf_counter() - start:10.4f}s", file=sys.stderr, flush=True)
+        bench_in_process(root, args, results)
+        if not args.skip_tools:
+            bench_startup(root, args, results)
+            bench_tools(root, args, results)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    params = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "keep")}
+    report = {"environment": environment(), "params": params, "results": results}
+    if args.output == "-":
+        print(json.dumps(report, indent=1))
+    elif args.output:
+        Path(args.output).write_text(json.dumps(report, indent=1), encoding=DEFAULT_TEXT_ENCODING)
+    if args.compare:
+        compare(results, json.loads(Path(args.compare).read_text(encoding=DEFAULT_TEXT_ENCODING))["results"])
+
+if __name__ == "__main__":
+    main()
@@ -2,47 +2,51 @@ import os
 import sys
 import argparse
 from pathlib import Path
+from contextlib import contextmanager, nullcontext
 import coverage
 import subprocess
-import bashlex
-import re
 import runpy
+import shlex
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from demo_driven.ddrun import (
-    demo_driven_config, BASH, DEFAULT_TEXT_ENCODING, get_shell_env,
+    demo_driven_config, ini_bash_path, DEFAULT_TEXT_ENCODING, SHIM_DIR_ENV, get_shell_env,
     load_target_dir_config, set_or_show_target_dir, restore_target_dir_config,
-    glob_sorted, match_pattern,
-    read_notebook, execute_notebook, notebook_outputs,
-    save_output_and_diff
+    glob_sorted, match_pattern, ini_serial_patterns,
+    RUNTIMES_FILE, IMPACT_FILE, load_cache_file, save_cache_file, runtime_key, file_digest,
+    kernel_pool, read_notebook, execute_notebook, notebook_outputs, stream_output,
+    save_output_and_diff, shard_spec, shard_scripts, shard_assignment, demo_result, save_run_results
 )
 
 import logging
 logger = logging.getLogger(__name__)
 
-SUPPRESSED_PATTERNS = [
-    re.compile(r"^.*Assertion failed: .+ \[\d+\] \(.+?:\d+\).*\n?", re.MULTILINE),
-    re.compile(
-        r"^.*coverage.control.py:\d+: CoverageWarning: No data was collected.*\n\s+self._warn\(.*\).*$\n?",
-        re.MULTILINE,
-    ),
-]
-
 COVERAGE_SECTION = "coverage-cli"
+CONTEXT_ENV = "DDCOV_CONTEXT"  # the demo being measured, read by tocov
+SYSMON_CORE = "sysmon"
+
+def sysmon_supported():
+    """coverage.py measures with sys.monitoring, disabling each line after its first hit, from Python 3.12 and coverage 7.4 on."""
+    return sys.version_info >= (3, 12) and coverage.version_info >= (7, 4)
 
 def ini_coverage_section():
-    if COVERAGE_SECTION in demo_driven_config:
-        return demo_driven_config[COVERAGE_SECTION]
+    if COVERAGE_SECTION in demo_driven_config():
+        return demo_driven_config()[COVERAGE_SECTION]
     return {}
 
-registered_cli = ini_coverage_section()
-
 def transform_shell_for_coverage(script_text: str) -> str:
+    registered_cli = ini_coverage_section()
+    if not registered_cli or os.environ.get(SHIM_DIR_ENV):  # with shims on PATH, nothing needs rewriting
+        return script_text
+    import bashlex  # only shell demos need it
     try:
         parts = bashlex.parse(script_text)
     except Exception:
         return script_text
-    if not registered_cli:
-        return script_text
 
     all_nodes = []
     for part in parts:
@@ -67,16 +71,18 @@ def transform_shell_for_coverage(script_text: str) -> str:
 
     return text
 
-def instrument_python_cell(nb):
+def instrument_python_cell(nb, data_file: str = None, context: str = None, core: str = None):
     cov_prefix = [
         "import coverage",
-        "cov = coverage.Coverage(omit=['*/ipykernel*/*.py'])",
+        f"cov = coverage.Coverage(data_file={data_file!r}, context={context!r}, omit=['*/ipykernel*/*.py'])",
         "cov.set_option('run:parallel', True)",
         "cov._warn_no_data = False",
         "cov._warn_preimported_source = False",
         "cov._warn_unimported_source = False",
         "cov.start()",
     ]
+    if data_file is not None:  # read by coverage.Coverage() below and by the shell commands run from the notebook
+        cov_prefix.insert(1, f"__import__('os').environ.update({coverage_settings(data_file, context, core)!r})")
     cov_suffix = [
         "cov.stop()",
         "cov.save()"
@@ -107,12 +113,52 @@ def instrument_python_cell(nb):
         if last_python_code_cell is not None:
             last_python_code_cell.source = "\n".join([last_python_code_cell.source] + cov_suffix)
 
-def run_script_with_coverage(script_file: Path):
-    shell_env = get_shell_env()
+TOCOV_RUNNER = "from demo_driven.ddcov import tocov; tocov()"
+
+def write_shim(shim_dir: str, cli_name: str, runner: str = TOCOV_RUNNER):
+    command = [sys.executable, "-c", runner, cli_name]
+    if sys.platform.startswith("win"):
+        Path(shim_dir, cli_name + ".cmd").write_text(f"@{subprocess.list2cmdline(command)} %*\r\n", encoding=DEFAULT_TEXT_ENCODING)
+    shim = Path(shim_dir, cli_name)  # for bash, on Windows too
+    shim.write_text(f'#!/bin/sh\nexec {shlex.join(command)} "$@"\n', encoding=DEFAULT_TEXT_ENCODING)
+    shim.chmod(0o755)
+
+@contextmanager
+def cli_shims(runner: str = TOCOV_RUNNER):
+    """Puts an executable that runs through runner ahead on PATH for each [coverage-cli] entry, for this process and its children."""
+    shim_dir = tempfile.mkdtemp(prefix="ddcov-shims-")
+    saved = {name: os.environ.get(name) for name in ["PATH", SHIM_DIR_ENV]}
+    try:
+        for cli_name in ini_coverage_section():
+            write_shim(shim_dir, cli_name, runner)
+        os.environ[SHIM_DIR_ENV] = shim_dir
+        os.environ["PATH"] = f"{shim_dir}{os.pathsep}{os.environ.get('PATH', '')}"
+        yield shim_dir
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        shutil.rmtree(shim_dir, ignore_errors=True)
+
+def coverage_settings(data_file: str, context: str, core: str = None):
+    settings = {"COVERAGE_FILE": data_file, CONTEXT_ENV: context}
+    if core:
+        settings["COVERAGE_CORE"] = core
+    return settings
+
+def run_script_with_coverage(script_file: Path, data_file: str, pool=None, core: str = None):
+    """Runs a demo with its coverage data saved to data_file.* under its own context, and returns its output.
+
+    With core="sysmon", the demo, its notebook kernel and tocov all measure through sys.monitoring.
+    """
+    context = runtime_key(script_file)
+    shell_env = get_shell_env() | coverage_settings(data_file, context, core)
     match script_file.suffix:
         case ".py":
             output = subprocess.run(
-                [sys.executable, "-m", "coverage", "run", "--parallel-mode", "--omit", script_file, script_file],
+                [sys.executable, "-m", "coverage", "run", "--parallel-mode", f"--context={context}", "--omit", script_file, script_file],
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
                 text=True,
@@ -121,14 +167,14 @@ def run_script_with_coverage(script_file: Path):
             ).stdout
         case ".ipynb":
             nb = read_notebook(script_file)
-            instrument_python_cell(nb)
-            execute_notebook(nb)
+            instrument_python_cell(nb, data_file, context, core)
+            execute_notebook(nb, pool)
             output = "\n".join(notebook_outputs(nb))
         case ".sh":
             original = script_file.read_text(encoding=DEFAULT_TEXT_ENCODING)
             transformed = transform_shell_for_coverage(original)
             output = subprocess.run(
-                BASH,
+                ini_bash_path(),
                 input=transformed,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
@@ -136,11 +182,82 @@ def run_script_with_coverage(script_file: Path):
                 encoding=DEFAULT_TEXT_ENCODING,
                 env=shell_env
             ).stdout
-    logger.debug(f"before {output!r}")
-    for pattern in SUPPRESSED_PATTERNS:
-        output = pattern.sub("", output)
-    logger.debug(f"after  {output!r}")
-    save_output_and_diff(script_file, output)
+        case _:  # a demo of a runner plugin, which is run but not measured
+            output = "".join(stream_output(script_file))
+    return output  # suppressed and normalized by save_output_and_diff, like the output of ddrun
+
+def combine_demo_data(cov: coverage.Coverage, data_file: str):
+    if data_files := [str(f) for f in Path(data_file).parent.glob(Path(data_file).name + ".*")]:
+        cov.combine(data_files)
+
+def save_impact_map(cov: coverage.Coverage, script_files: list[Path]):
+    """Records, for ddrun --changed, the files and lines each demo ran, with a hash of each file."""
+    ran = {runtime_key(f): {str(f.resolve()): set()} for f in script_files}
+    data = cov.get_data()
+    for file in data.measured_files():
+        for lineno, contexts in data.contexts_by_lineno(file).items():
+            for context in contexts:
+                if context in ran:
+                    ran[context].setdefault(file, set()).add(lineno)
+    save_cache_file(IMPACT_FILE, {
+        demo: {"files": {file: {"sha256": file_digest(file), "lines": sorted(lines)} for file, lines in files.items()}}
+        for demo, files in ran.items()
+    })
+
+def run_scripts_with_coverage(script_files: list[Path], jobs: int, original_dddir, cov: coverage.Coverage, pool=None, core: str = None, results: dict = None):
+    """Runs demos on up to jobs workers; each finished demo's data is merged into cov while the others still run.
+
+    When results is given, the state and runtime of each demo are stored in it, as demo_result() entries.
+    """
+    data_dir = tempfile.mkdtemp(prefix="ddcov-")
+    data_files = {f: os.path.join(data_dir, f"{n}") for n, f in enumerate(script_files)}
+    combine_lock = threading.Lock()
+
+    def timed_run(script_file: Path):
+        start = time.perf_counter()
+        output = run_script_with_coverage(script_file, data_files[script_file], pool, core)
+        elapsed = time.perf_counter() - start
+        with combine_lock:  # merged by the worker as it finishes; only the reports follow the order of the demos
+            combine_demo_data(cov, data_files[script_file])
+        return output, elapsed
+
+    def report(script_file: Path, ran):
+        output, elapsed = ran
+        state = save_output_and_diff(script_file, output)
+        if results is not None:
+            results[runtime_key(script_file)] = demo_result(script_file, state, round(elapsed, 3))
+
+    try:
+        if jobs <= 1:
+            for script_file in script_files:
+                report(script_file, timed_run(script_file))
+                restore_target_dir_config(original_dddir)
+            return
+
+        # demos that call ddrun -d themselves share .dddir, so they must not overlap
+        serial = set(f for pattern in ini_serial_patterns() for f in match_pattern(pattern, script_files))
+        serial_lock = threading.Lock()
+
+        def run(script_file: Path):
+            with serial_lock if script_file in serial else nullcontext():
+                try:
+                    return timed_run(script_file)
+                finally:
+                    if script_file in serial:
+                        restore_target_dir_config(original_dddir)
+
+        runtimes = load_cache_file(RUNTIMES_FILE)  # recorded by ddrun; coverage slows demos down about evenly
+        longest_first = sorted(script_files, key=lambda f: runtimes.get(runtime_key(f), float("inf")), reverse=True)
+        executor = ThreadPoolExecutor(max_workers=jobs)
+        try:
+            futures = {f: executor.submit(run, f) for f in longest_first}
+            for script_file in script_files:
+                report(script_file, futures[script_file].result())
+        finally:
+            executor.shutdown(cancel_futures=True)
+            restore_target_dir_config(original_dddir)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -149,28 +266,72 @@ def main():
     )
     parser.add_argument("names", nargs="*", help="Run the specified demo scripts, or run all if none are specified")
     parser.add_argument("-d", "--dir", nargs="?", const="", help="Set or show the target demo directory containing demo scripts")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Run demo scripts on N parallel workers, longest first (0 means one per CPU)")
+    parser.add_argument("-k", "--kernel-pool", type=int, default=0, metavar="N", help="Run notebooks on up to N reused warm kernels instead of a new kernel each")
+    parser.add_argument("--shard", type=shard_spec, metavar="I/N", help="Run only the I-th of N parts of the demos, balanced by recorded runtimes, saving coverage data to .coverage.shard-I-of-N for ddmerge")
+    parser.add_argument("--results", metavar="FILE", help="Write the state, runtime and diff of each demo as JSON (default with --shard: ddcov-shard-I-of-N.json)")
+    parser.add_argument("--shims", action="store_true", help="Cover [coverage-cli] commands through shims put on PATH, at any nesting depth, instead of rewriting shell scripts")
+    parser.add_argument("--sysmon", action="store_true", help="Measure with sys.monitoring instead of a trace function, which is much faster (Python 3.12+)")
     args = parser.parse_args()
+    jobs = args.jobs or os.cpu_count() or 1
+    core = None
+    if args.sysmon:
+        if sysmon_supported():
+            core = SYSMON_CORE
+        else:
+            print("ddcov: --sysmon needs Python 3.12 and coverage 7.4 or later, using the default tracer")
 
     original_dddir, demo_dir = load_target_dir_config()
 
     if args.dir is not None:
         return set_or_show_target_dir(demo_dir, args.dir, bool(args.names))
 
-    all_script_files = glob_sorted(demo_dir)
-    if args.names:
-        for pattern in args.names:
-            if matched := match_pattern(pattern, all_script_files):
-                for script_file in matched:
-                    run_script_with_coverage(script_file)
-                    restore_target_dir_config(original_dddir)
-            else:
-                print(f"{pattern}: not found")
+    discovered = all_script_files = glob_sorted(demo_dir)
+    settings = {}
+    if args.shard:
+        all_script_files = shard_scripts(all_script_files, args.shard)
+        settings["data_file"] = f".coverage.shard-{args.shard[0]}-of-{args.shard[1]}"  # combined by ddmerge or coverage combine
+    started = time.perf_counter()
+    results = {}
+    cov = coverage.Coverage(**settings)  # starts empty; each demo's data is combined into it as soon as it is reported
+    with cli_shims() if args.shims else nullcontext(), kernel_pool(args.kernel_pool) as pool:  # kernels inherit the shims
+        ran = []
+
+        def run(script_files: list[Path]):
+            run_scripts_with_coverage(script_files, jobs, original_dddir, cov, pool, core, results)
+            ran.extend(script_files)
+
+        if args.names and jobs > 1:
+            selected = []
+            for pattern in args.names:
+                if matched := match_pattern(pattern, all_script_files):
+                    selected.extend(f for f in matched if f not in selected)
+                else:
+                    print(f"{pattern}: not found")
+            run(selected)
+        elif args.names:
+            for pattern in args.names:
+                if matched := match_pattern(pattern, all_script_files):
+                    run(matched)
+                else:
+                    print(f"{pattern}: not found")
+        else:
+            run(all_script_files)
+    cov.save()
+    if ran:
+        save_impact_map(cov, ran)
+    if args.shard or args.results:
+        assignment = shard_assignment(discovered, all_script_files) if args.shard else {}
+        save_run_results("ddcov", args.shard, args.results, results, started, coverage=os.path.basename(cov.get_data().data_filename()), **assignment)
+
+def run_cli(cli_name: str, args: list[str]):
+    mod, _, func = ini_coverage_section()[cli_name].partition(":")
+    sys.argv = [cli_name] + args
+    if not func:
+        runpy.run_module(mod, run_name="__main__")
     else:
-        for script_file in all_script_files:
-            run_script_with_coverage(script_file)
-            restore_target_dir_config(original_dddir)
-    cov = coverage.Coverage()
-    cov.combine()
+        module = __import__(mod, fromlist=[func])
+        getattr(module, func)()
 
 def tocov():
     args = sys.argv[1:]
@@ -181,25 +342,17 @@ def tocov():
 
     cli_name = args[0]
 
-    if cli_name not in registered_cli:
+    if cli_name not in ini_coverage_section():
         print(f"tocov: command '{cli_name}' not registered in [{COVERAGE_SECTION}] of demo_driven.ini")
         sys.exit(1)
 
-    entry = registered_cli[cli_name]
-    mod, _, func = entry.partition(":")
-
-    cov = coverage.Coverage()
+    cov = coverage.Coverage(context=os.environ.get(CONTEXT_ENV))
     cov.set_option("run:parallel", True)
     cov._warn_no_data = False
     cov._warn_preimported_source = False
     cov._warn_unimported_source = False
     cov.start()
-    sys.argv = [cli_name] + args[1:]
-    if not func:
-        runpy.run_module(mod, run_name="__main__")
-    else:
-        module = __import__(mod, fromlist=[func])
-        getattr(module, func)()
+    run_cli(cli_name, args[1:])
     cov.stop()
     cov.save()
 
@@ -0,0 +1,287 @@
+"""Keeps ddrun, ddnbo and ddcov warm in a daemon, for the many short calls that shell demos make.
+
+Usage: dddaemon {start,stop,status}
+
+The daemon serves the directory it was started in, over the unix socket .ddcache/daemon.sock.
+It has imported the tools, with nbformat, nbclient, coverage and bashlex, and parsed
+demo_driven.ini once. The ddrun, ddnbo and ddcov commands are thin clients: they send their
+arguments, working directory and environment to the daemon, together with their stdin, stdout
+and stderr, so the output goes straight where theirs would. The daemon forks a child that runs
+the tool on them, replies with the child's pid, through which the client forwards Ctrl+C, and
+with its exit status once it has finished.
+
+When no daemon serves the current directory, or it runs another interpreter, or the source of
+demo_driven changed since it started, the command runs in its own process as usual. A daemon
+that finds its source changed exits. DDRUN_NO_DAEMON=1 makes the commands ignore the daemon.
+
+This module is imported by every command, so it imports the tools only when it has to.
+"""
+import io
+import os
+import sys
+import json
+import socket
+import signal
+import atexit
+import importlib
+import threading
+import traceback
+from contextlib import suppress
+
+SOCKET_FILE = os.path.join(".ddcache", "daemon.sock")  # ddrun.CACHE_DIR, without importing ddrun
+NO_DAEMON_ENV = "DDRUN_NO_DAEMON"
+TOOLS = {"ddrun": "demo_driven.ddrun", "ddnbo": "demo_driven.ddnbo", "ddcov": "demo_driven.ddcov"}
+# imported by the tools only when they need them, but by the daemon up front
+HEAVY_MODULES = ["nbformat", "nbclient", "demo_driven.kernelpool", "bashlex", "pstats", "statistics", "concurrent.futures"]
+REQUEST_SIZE = 1 << 20
+
+def is_supported():
+    return hasattr(os, "fork") and hasattr(socket, "send_fds")
+
+def daemon_request(request: dict, fds: list[int] = ()):  # -> connected socket, or None if no daemon listens
+    if not is_supported() or not os.path.exists(SOCKET_FILE):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(SOCKET_FILE)
+        socket.send_fds(sock, [json.dumps(request).encode()], list(fds))
+    except OSError:  # a socket left behind by a daemon that was killed, or a standard stream that is closed
+        sock.close()
+        return None
+    return sock
+
+def run_on_daemon(tool: str):  # -> exit status, or None if no daemon ran the tool
+    if os.environ.get(NO_DAEMON_ENV):
+        return None
+    request = {
+        "tool": tool, "args": sys.argv[1:], "cwd": os.getcwd(), "env": dict(os.environ),
+        "executable": sys.executable, "encoding": (sys.stdout.encoding, sys.stdout.errors),
+        "unbuffered": getattr(sys.stdout, "write_through", False)  # set by python -u or PYTHONUNBUFFERED
+    }
+    if (sock := daemon_request(request, [0, 1, 2])) is None:
+        return None
+    with sock, sock.makefile("rb") as replies:
+        reply = json.loads(replies.readline() or "{}")
+        if "pid" not in reply:  # refused, see reply["fallback"]
+            return None
+        forward = lambda signum, frame: os.kill(reply["pid"], signum)
+        previous = {signum: signal.signal(signum, forward) for signum in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            line = replies.readline()
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        return json.loads(line)["returncode"] if line else 1  # nothing if the child was killed
+
+def run_tool(tool: str):
+    """Runs a command on the daemon of the current directory if there is one, or else in this process."""
+    if (code := run_on_daemon(tool)) is not None:
+        return code
+    return importlib.import_module(TOOLS[tool]).main()
+
+def ddrun():
+    return run_tool("ddrun")
+
+def ddnbo():
+    return run_tool("ddnbo")
+
+def ddcov():
+    return run_tool("ddcov")
+
+def source_stamps():
+    """Modification times of the demo_driven modules loaded, and of demo_driven.ini."""
+    files = [getattr(module, "__file__", None) for name, module in list(sys.modules.items()) if name.startswith("demo_driven.")]
+    stamps = {}
+    for file in filter(None, files + ["demo_driven.ini"]):
+        try:
+            stamps[file] = os.stat(file).st_mtime_ns
+        except OSError:
+            stamps[file] = None
+    return stamps
+
+def refusal(request: dict, stamps: dict):  # -> why the daemon cannot run the request, or None
+    if request.get("tool") not in TOOLS:
+        return f"unknown tool {request.get('tool')!r}"
+    if os.path.realpath(request.get("executable", "")) != os.path.realpath(sys.executable):
+        return f"daemon runs {sys.executable}"
+    if os.path.realpath(request.get("cwd", "")) != os.path.realpath(os.getcwd()):
+        return "daemon serves another directory"
+    if changed := [file for file, stamp in source_stamps().items() if stamps.get(file) != stamp and not file.endswith(".ini")]:
+        return f"{changed[0]} changed"
+    return None
+
+def reply(conn: socket.socket, message: dict):
+    conn.sendall(json.dumps(message).encode() + b"\n")
+
+def daemon_reply(command: str):  # -> the daemon's reply to a command, or None if no daemon listens
+    if (sock := daemon_request({"command": command})) is None:
+        return None
+    with sock, sock.makefile("rb") as replies:
+        return json.loads(replies.readline() or "null")
+
+def serve(listener: socket.socket, stamps: dict):
+    """Accepts requests until stopped, returning None; in a forked child, returns the request it has to run."""
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # children are reaped automatically
+    served = 0
+    while True:
+        conn, _ = listener.accept()
+        try:
+            msg, fds, _, _ = socket.recv_fds(conn, REQUEST_SIZE, 3)
+            request = json.loads(msg)
+        except (OSError, ValueError):
+            conn.close()
+            continue
+        if command := request.get("command"):
+            with conn, suppress(OSError):  # the client may be gone already
+                reply(conn, {"pid": os.getpid(), "served": served})
+            if command == "stop":
+                return None
+            continue
+        if reason := refusal(request, stamps):
+            with conn, suppress(OSError):
+                reply(conn, {"fallback": reason})
+            for fd in fds:
+                os.close(fd)
+            if reason.endswith(" changed"):  # the tools it has loaded are out of date
+                return None
+            continue
+        served += 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if os.fork() == 0:
+            listener.close()
+            return conn, request, fds
+        conn.close()
+        for fd in fds:
+            os.close(fd)
+
+def output_stream(fd: int, encoding: str, errors: str, line_buffering: bool, unbuffered: bool):
+    """A text stream on fd, buffered the way the interpreter buffers sys.stdout and sys.stderr."""
+    binary = open(fd, "wb", buffering=0 if unbuffered else -1, closefd=False)
+    return io.TextIOWrapper(binary, encoding, errors, line_buffering=line_buffering, write_through=unbuffered)
+
+def run_child(conn: socket.socket, request: dict, fds: list[int], stamps: dict):
+    from demo_driven.zygote import exit_code
+    reply(conn, {"pid": os.getpid()})
+    for stream, fd in enumerate(fds):
+        os.dup2(fd, stream)
+        os.close(fd)
+    os.environ.clear()
+    os.environ.update(request["env"])
+    for signum in (signal.SIGCHLD, signal.SIGTERM):
+        signal.signal(signum, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    # new standard streams on the client's, set up the way the client's interpreter set up its own
+    encoding, errors = request["encoding"]
+    sys.stdin = open(0, encoding=encoding, errors=errors, closefd=False)
+    unbuffered = request.get("unbuffered", False)
+    sys.stdout = output_stream(1, encoding, errors, os.isatty(1), unbuffered)
+    sys.stderr = output_stream(2, encoding, "backslashreplace", True, unbuffered)
+    sys.argv = [request["tool"]] + request["args"]
+    ddrun = sys.modules["demo_driven.ddrun"]
+    ddrun.PYTHON_UTF8_ENV.clear()  # in place, since it is also the default of some parameters
+    ddrun.PYTHON_UTF8_ENV.update(ddrun.get_shell_env())
+    if source_stamps().get("demo_driven.ini") != stamps.get("demo_driven.ini"):
+        ddrun.reload_demo_driven_ini()
+    try:
+        code = exit_code(SystemExit(importlib.import_module(TOOLS[request["tool"]]).main()))
+    except SystemExit as e:
+        code = exit_code(e)
+    except KeyboardInterrupt:
+        traceback.print_exc()
+        code = 130
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    # finish the way the interpreter does: wait for threads, run atexit handlers, flush
+    if hasattr(threading, "_shutdown"):
+        threading._shutdown()
+    atexit._run_exitfuncs()
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except Exception:
+            pass
+    reply(conn, {"returncode": code})
+    conn.close()
+    os._exit(code)
+
+def run_daemon():
+    """Preloads the tools, listens on SOCKET_FILE and serves until stopped; run by dddaemon start."""
+    for module in TOOLS.values():
+        try:
+            importlib.import_module(module)
+        except Exception as e:  # e.g. ddcov without coverage; the clients of that tool fall back
+            print(f"dddaemon: cannot preload {module}: {e}", flush=True)
+    for module in HEAVY_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:  # an optional dependency, e.g. of notebooks
+            pass
+    stamps = source_stamps()
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(SOCKET_FILE)
+    listener.listen(64)
+    pid = os.getpid()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print("ready", flush=True)
+    try:
+        forked = serve(listener, stamps)
+    finally:
+        if os.getpid() == pid:
+            listener.close()
+            os.unlink(SOCKET_FILE)
+    if forked is not None:
+        run_child(*forked, stamps)
+
+def start_daemon():
+    import subprocess
+    if daemon_reply("status"):
+        print(f"dddaemon: already serving {os.getcwd()}")
+        return
+    os.makedirs(os.path.dirname(SOCKET_FILE), exist_ok=True)
+    if os.path.exists(SOCKET_FILE):  # left behind by a daemon that was killed
+        os.unlink(SOCKET_FILE)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "demo_driven.dddaemon", "serve"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        start_new_session=True  # not stopped by a Ctrl+C meant for the command that started it
+    )
+    while line := proc.stdout.readline():
+        if line.strip() == "ready":
+            print(f"dddaemon: serving {os.getcwd()} (pid {proc.pid})")
+            return
+        print(line, end="")
+    print("dddaemon: failed to start")
+    sys.exit(1)
+
+def daemon_status(command: str):
+    if not (reply := daemon_reply(command)):
+        print("dddaemon: not running")
+        return
+    if command == "stop":
+        print(f"dddaemon: stopped (pid {reply['pid']})")
+    else:
+        print(f"dddaemon: serving {os.getcwd()} (pid {reply['pid']}), {reply['served']} commands run")
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Keep ddrun, ddnbo and ddcov warm for the current directory")
+    parser.add_argument("command", choices=["start", "stop", "status", "serve"], help="Start, stop or show the daemon; serve is run by start")
+    args = parser.parse_args()
+    if not is_supported():
+        print("dddaemon: needs fork and unix sockets, which this platform lacks")
+        sys.exit(1)
+    match args.command:
+        case "start":
+            start_daemon()
+        case "serve":
+            run_daemon()
+        case _:
+            daemon_status(args.command)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Runs a demo script as __main__, the same way `python script.py` would.
+
+Usage: python -m demo_driven.ddexec [--record-modules FILE] [--profile FILE] script.py [args...]
+"""
+import os
+import sys
+import json
+import site
+import atexit
+import builtins
+import types
+
+def non_local_prefixes():
+    prefixes = {sys.prefix, sys.base_prefix, sys.exec_prefix, sys.base_exec_prefix}
+    prefixes.update(site.getsitepackages() if hasattr(site, "getsitepackages") else [])
+    prefixes.add(site.getusersitepackages())
+    return tuple(os.path.join(os.path.realpath(p), "") for p in prefixes if p)
+
+def local_module_files():
+    """Source files of the loaded modules that live outside the interpreter and site-packages."""
+    prefixes = non_local_prefixes()
+    files = set()
+    for module in list(sys.modules.values()):
+        file = getattr(module, "__file__", None)
+        if file and os.path.isfile(file):
+            file = os.path.realpath(file)
+            if not file.startswith(prefixes):
+                files.add(file)
+    return sorted(files)
+
+def record_modules(modules_file: str):
+    with open(modules_file, "w", encoding="utf-8") as f:
+        json.dump(local_module_files(), f)
+
+def run_main(script: str, args: list[str]):
+    sys.argv = [script] + args
+    sys.path[0] = os.path.dirname(os.path.realpath(script))
+    script = os.path.abspath(script)
+    main = types.ModuleType("__main__")
+    main.__file__ = script
+    main.__builtins__ = builtins
+    main.__cached__ = None
+    sys.modules["__main__"] = main
+    try:
+        with open(script, "rb") as f:
+            code = compile(f.read(), script, "exec")
+        exec(code, main.__dict__)
+    except (SystemExit, KeyboardInterrupt):
+        raise
+    except BaseException as e:
+        # hide our own frames so the traceback reads as if python ran the script directly
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename == __file__:
+            tb = tb.tb_next
+        e.__traceback__ = tb  # the default hook prints e.__traceback__ rather than its tb argument
+        sys.excepthook(type(e), e, tb)
+        sys.exit(1)
+
+def start_profile(profile_file: str):
+    import cProfile
+    profiler = cProfile.Profile()
+    def stop():
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+    atexit.register(stop)
+    profiler.enable()
+
+def main():
+    args = sys.argv[1:]
+    if args[:1] == ["--record-modules"]:
+        # registered first so it runs last, after the script's own atexit handlers
+        atexit.register(record_modules, args[1])
+        args = args[2:]
+    if args[:1] == ["--profile"]:
+        start_profile(args[1])
+        args = args[2:]
+    if not args:
+        print("ddexec: no script provided", file=sys.stderr)
+        sys.exit(2)
+    run_main(args[0], args[1:])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Merges the result files of sharded ddrun, ddnbo and ddcov runs into one summary.
+
+Usage: ddmerge RESULTS.json ... [-o summary.json]
+
+The coverage data of ddcov shards, named in their result files and looked up next to them or
+in the current directory, is combined into the default coverage data file, usually .coverage.
+Exits with status 1 if a demo changed, failed, mismatched or timed out, if a shard is missing, or if
+the shards did not take each of the demos they discovered exactly once.
+"""
+import sys
+import json
+import argparse
+from pathlib import Path
+
+from demo_driven.ddrun import DEFAULT_TEXT_ENCODING
+
+PROBLEM_STATES = ("changed", "stopped", "failed", "mismatched", "timeout")
+
+def find_coverage_file(results_file: Path, name: str):
+    for candidate in [results_file.parent / name, Path(name)]:
+        if candidate.exists():
+            return candidate
+    return None
+
+def combine_coverage(files: list[Path]):
+    import coverage
+    cov = coverage.Coverage()
+    cov.combine([str(f) for f in files], keep=True)
+    cov.save()
+    return cov.get_data().data_filename()
+
+def missing_shards(reports: list[dict]):
+    counts = {}
+    for report in reports:
+        if report["shard"]:
+            index, count = map(int, report["shard"].split("/"))
+            counts.setdefault((report["tool"], count), set()).add(index)
+    return [f"{tool} shard {i}/{count}" for (tool, count), seen in counts.items() for i in range(1, count + 1) if i not in seen]
+
+def partition_problems(reports: list[dict]):
+    """Demos that the shards of a run took twice or not at all, as the shards disagreed on the partition."""
+    shards = {}
+    for report in reports:
+        if report["shard"] and "assigned" in report:
+            index, count = map(int, report["shard"].split("/"))
+            shards.setdefault((report["tool"], count), {})[index] = report
+    problems = []
+    for (tool, count), by_index in shards.items():
+        if len(by_index) < count:  # reported as missing shards
+            continue
+        if len({tuple(sorted(report["discovered"])) for report in by_index.values()}) > 1:
+            problems.append(f"{tool}: the shards discovered different demos")
+        taken = {}
+        for index, report in sorted(by_index.items()):
+            for key in report["assigned"]:
+                taken.setdefault(key, []).append(f"{index}/{count}")
+        for key in by_index[1]["discovered"]:
+            if len(in_shards := taken.get(key, [])) != 1:
+                problems.append(f"{key}: {tool} ran it in shards {' and '.join(in_shards)}" if in_shards else f"{key}: {tool} ran it in no shard")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the results of sharded ddrun, ddnbo and ddcov runs")
+    parser.add_argument("files", nargs="+", help="Result files written by --shard or --results")
+    parser.add_argument("-o", "--output", help="Write the merged results as JSON to this file")
+    args = parser.parse_args()
+
+    reports = []
+    coverage_files = []
+    for file in map(Path, args.files):
+        report = json.loads(file.read_text(encoding=DEFAULT_TEXT_ENCODING))
+        reports.append(report)
+        if name := report.get("coverage"):
+            if coverage_file := find_coverage_file(file, name):
+                coverage_files.append(coverage_file)
+            else:
+                print(f"{file}: coverage data {name} not found")
+
+    merged = {}
+    for report in reports:
+        tool = merged.setdefault(report["tool"], {"shards": {}, "demos": {}})
+        tool["shards"][report["shard"] or "-"] = report["seconds"]
+        for key, result in report["demos"].items():
+            tool["demos"][key] = result | {"shard": report["shard"]}
+
+    problems = []
+    for name, tool in merged.items():
+        counts = {}
+        for result in tool["demos"].values():
+            counts[result["state"]] = counts.get(result["state"], 0) + 1
+        slowest = max(tool["shards"].items(), key=lambda item: item[1])
+        print(f"{name}: {len(tool['demos'])} demos in {len(tool['shards'])} shards, "
+              + ", ".join(f"{count} {state}" for state, count in sorted(counts.items()))
+              + f"; slowest shard {slowest[0]} took {slowest[1]:.1f}s")
+        for key, result in tool["demos"].items():
+            if result["state"] in PROBLEM_STATES or result.get("metrics_exceeded") or result.get("profile_grew"):
+                details = [result["state"]]
+                if result.get("metrics_exceeded"):
+                    details.append("metrics exceed tolerance")
+                if result.get("profile_grew"):
+                    details.append("profile grew")
+                if "diff" in result:
+                    details.append(f"see {result['diff']}")
+                problems.append(f"{key}: {', '.join(details)} (shard {result['shard']})")
+    for problem in problems:
+        print(problem)
+    missing = missing_shards(reports)
+    for shard in missing:
+        print(f"{shard}: no results")
+    if partition := partition_problems(reports):
+        print("\n".join(partition))
+
+    if coverage_files:
+        data_file = combine_coverage(coverage_files)
+        print(f"coverage data of {len(coverage_files)} shards combined into {data_file}")
+    if args.output:
+        Path(args.output).write_text(json.dumps(merged, indent=1), encoding=DEFAULT_TEXT_ENCODING)
+    sys.exit(1 if problems or missing or partition else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,111 @@
 import argparse
+import os
 import sys
+import copy
+import time
+import asyncio
 from pathlib import Path
+from contextlib import closing, aclosing
 from demo_driven.ddrun import (
     JUPYTER_AVAILABLE,
     load_target_dir_config, set_or_show_target_dir,
-    glob_sorted, match_pattern,
-    read_notebook, save_notebook, execute_notebook, notebook_cell_output_text
+    glob_sorted, match_pattern, demo_label,
+    kernel_pool, read_notebook, save_notebook, execute_notebook_cells, async_execute_notebook_cells,
+    demo_normalizer, ini_mime_policies, runtime_key, shard_spec, shard_scripts, shard_assignment, demo_result, save_run_results
 )
+from demo_driven.nbdigest import cell_digests
 
-def compare_and_fix_outputs(ipynb_file: Path, fix: bool, force: bool):
+def start_check(ipynb_file: Path, fix: bool, force: bool, max_mismatches: int = 0):
+    """Reads the notebook and returns the state of comparing it with its executed cells, as a dict."""
     original_nb = read_notebook(ipynb_file)
-    executed_nb = read_notebook(ipynb_file)  # copy
-    execute_notebook(executed_nb)
-    modified = False
-    mismatched_cells = []
-    code_index = 0
-    for orig_cell, exec_cell in zip(original_nb.cells, executed_nb.cells):
-        if orig_cell.cell_type != "code":
-            continue
-        code_index += 1
-
-        if force:
+    return {
+        "file": ipynb_file, "nb": original_nb, "fix": fix, "force": force,
+        "code_cells": [cell for cell in original_nb.cells if cell.cell_type == "code"],
+        "fail_fast": max_mismatches if not fix and not force else 0,
+        "normalize": demo_normalizer(ipynb_file),  # outputs that differ only in masked parts still match
+        "policies": ini_mime_policies(),
+        "modified": False, "mismatched": [], "stopped_early": False,
+    }
+
+def check_cell(check: dict, code_index: int, exec_cell):  # -> True to stop executing the notebook
+    orig_cell = check["code_cells"][code_index - 1]
+    policies, normalize = check["policies"], check["normalize"]
+    if check["force"]:
+        orig_cell["outputs"] = exec_cell.get("outputs", [])
+        check["modified"] = True
+    elif cell_digests(orig_cell, policies, normalize) != cell_digests(exec_cell, policies, normalize):
+        check["mismatched"].append(code_index)
+        if check["fix"]:
             orig_cell["outputs"] = exec_cell.get("outputs", [])
-            modified = True
-        elif notebook_cell_output_text(orig_cell) != notebook_cell_output_text(exec_cell):
-            mismatched_cells.append(code_index)
-            if fix:
-                orig_cell["outputs"] = exec_cell.get("outputs", [])
-                modified = True
-
-    if not fix and not force:
+            check["modified"] = True
+        elif check["fail_fast"] and len(check["mismatched"]) >= check["fail_fast"]:
+            check["stopped_early"] = code_index < len(check["code_cells"])
+            return True
+    return False
+
+def finish_check(check: dict):  # -> state, mismatched cells, message
+    name, mismatched_cells = demo_label(check["file"]), check["mismatched"]
+    if not check["fix"] and not check["force"]:
         if mismatched_cells:
             cells = "".join(f"[{i}]" for i in mismatched_cells)
-            print(f"{ipynb_file.name}: {cells} mismatched")
-        else:
-            print(f"{ipynb_file.name}: outputs matched")
-    else:
-        if modified:
-            save_notebook(original_nb, ipynb_file)
-            print(f"{ipynb_file.name}: outputs updated")
-        else:
-            print(f"{ipynb_file.name}: no need to update")
+            if check["stopped_early"]:
+                return "mismatched", mismatched_cells, f"{name}: {cells} mismatched, stopped early"
+            return "mismatched", mismatched_cells, f"{name}: {cells} mismatched"
+        return "matched", mismatched_cells, f"{name}: outputs matched"
+    if check["modified"]:
+        save_notebook(check["nb"], check["file"])
+        return "updated", mismatched_cells, f"{name}: outputs updated"
+    return "matched", mismatched_cells, f"{name}: no need to update"
+
+def compare_and_fix_outputs(ipynb_file: Path, fix: bool, force: bool, pool=None, max_mismatches: int = 0):  # -> state, cells, message
+    check = start_check(ipynb_file, fix, force, max_mismatches)
+    with closing(execute_notebook_cells(copy.deepcopy(check["nb"]), pool)) as executed_cells:
+        for code_index, exec_cell in enumerate(executed_cells, 1):
+            if check_cell(check, code_index, exec_cell):
+                break
+    return finish_check(check)
+
+async def async_compare_and_fix_outputs(ipynb_file: Path, fix: bool, force: bool, max_mismatches: int = 0):  # -> state, cells, message
+    check = start_check(ipynb_file, fix, force, max_mismatches)
+    async with aclosing(async_execute_notebook_cells(copy.deepcopy(check["nb"]))) as executed_cells:
+        code_index = 0
+        async for exec_cell in executed_cells:
+            code_index += 1
+            if check_cell(check, code_index, exec_cell):
+                break
+    return finish_check(check)
+
+async def check_notebooks(ipynb_files: list[Path], jobs: int, timeout: float, report, **options):
+    """Checks up to jobs notebooks at a time on one event loop, and reports their results in the given order.
+
+    A notebook still running after timeout seconds is cancelled and its kernel shut down. If checking
+    a notebook fails, or the run is interrupted, the notebooks still running are cancelled as well.
+    """
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def check(ipynb_file: Path):
+        async with semaphore:
+            start = time.perf_counter()
+            # nbclient turns the cancellation of a running cell into DeadKernelError, so wait_for cannot be used
+            task = asyncio.create_task(async_compare_and_fix_outputs(ipynb_file, **options))
+            try:
+                done, _ = await asyncio.wait([task], timeout=timeout)
+            finally:
+                if not task.done():
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+            if not done:
+                return "timeout", [], f"{demo_label(ipynb_file)}: timed out after {timeout:g}s", time.perf_counter() - start
+            return *task.result(), time.perf_counter() - start
+
+    tasks = [asyncio.create_task(check(ipynb_file)) for ipynb_file in ipynb_files]
+    try:
+        for ipynb_file, task in zip(ipynb_files, tasks):
+            report(ipynb_file, *await task)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 def main():
     if not JUPYTER_AVAILABLE:
@@ -53,6 +118,12 @@ def main():
     parser.add_argument("-d", "--dir", nargs="?", const="", help="Set or show the target directory containing notebooks.")
     parser.add_argument("-f", "--fix", action="store_true", help="Fix outputs if they mismatch actual execution results, otherwise keep the notebook untouched")
     parser.add_argument("-F", "--force", action="store_true", help="Force execution and overwrite all outputs with actual results")
+    parser.add_argument("-k", "--kernel-pool", type=int, default=0, metavar="N", help="Run notebooks on up to N reused warm kernels instead of a new kernel each")
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N", help="Check up to N notebooks at a time, each on a kernel of its own (0 means one per CPU)")
+    parser.add_argument("--timeout", type=float, metavar="SECONDS", help="Stop a notebook that runs longer than this and report it as timed out")
+    parser.add_argument("--shard", type=shard_spec, metavar="I/N", help="Check only the I-th of N parts of the notebooks, balanced by recorded runtimes, and write its results for ddmerge")
+    parser.add_argument("--results", metavar="FILE", help="Write the state, runtime and mismatched cells of each notebook as JSON (default with --shard: ddnbo-shard-I-of-N.json)")
+    parser.add_argument("-x", "--fail-fast", type=int, nargs="?", const=1, default=0, metavar="N", help="When checking, stop executing a notebook after its first (or Nth) mismatched cell")
     args = parser.parse_args()
 
     original_dddir, demo_dir = load_target_dir_config()
@@ -60,15 +131,36 @@ def main():
     if args.dir is not None:
         return set_or_show_target_dir(demo_dir, args.dir, bool(args.names))
 
-    all_ipynb_files = glob_sorted(demo_dir, order={".ipynb": ".ipynb"})
+    discovered = all_ipynb_files = glob_sorted(demo_dir, order={".ipynb": ".ipynb"})
+    if args.shard:
+        all_ipynb_files = shard_scripts(all_ipynb_files, args.shard)
     if args.names:
-        for pattern in args.names:
-            if matched := match_pattern(pattern, all_ipynb_files):
-                for ipynb_file in matched:
-                    compare_and_fix_outputs(ipynb_file, args.fix, args.force)
+        ipynb_files = [ipynb_file for pattern in args.names for ipynb_file in match_pattern(pattern, all_ipynb_files)]
+    else:
+        ipynb_files = all_ipynb_files
+    started = time.perf_counter()
+    results = {}
+
+    def report(ipynb_file: Path, state: str, cells: list, message: str, seconds: float):
+        print(message)
+        results[runtime_key(ipynb_file)] = demo_result(ipynb_file, state, round(seconds, 3), cells=cells)
+
+    options = dict(fix=args.fix, force=args.force, max_mismatches=args.fail_fast)
+    if args.jobs != 1 or args.timeout:
+        if args.kernel_pool:
+            print("ddnbo: -k is ignored with -j or --timeout, where each notebook gets a kernel of its own")
+        try:
+            asyncio.run(check_notebooks(ipynb_files, args.jobs if args.jobs > 0 else os.cpu_count(), args.timeout, report, **options))
+        except KeyboardInterrupt:
+            sys.exit(130)
     else:
-        for ipynb_file in all_ipynb_files:
-            compare_and_fix_outputs(ipynb_file, args.fix, args.force)
+        with kernel_pool(args.kernel_pool) as pool:
+            for ipynb_file in ipynb_files:
+                start = time.perf_counter()
+                report(ipynb_file, *compare_and_fix_outputs(ipynb_file, pool=pool, **options), time.perf_counter() - start)
+    if args.shard or args.results:
+        assignment = shard_assignment(discovered, all_ipynb_files) if args.shard else {}
+        save_run_results("ddnbo", args.shard, args.results, results, started, **assignment)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,119 @@
+"""Profiles demos with cProfile for ddrun --profile, and compares their profiles with the accepted ones.
+
+Each profiled process of a demo writes its stats into a directory of the demo's own: a .py demo
+through ddexec, a notebook's kernel through cells run before and after the notebook's own, and
+each [coverage-cli] command through a shim put ahead on PATH, like those of ddcov --shims. The
+stats of all of them add up to the demo's profile.
+
+Functions are identified by file and name, so a profile still compares after lines were added
+above a function. Functions of the same name in one file are added up.
+"""
+import os
+import sys
+from pathlib import Path
+from contextlib import contextmanager
+
+PROFILE_DIR_ENV = "DDRUN_PROFILE_DIR"
+KERNEL_PROFILE = "kernel.prof"
+
+def profile_cells(profile_dir: str):  # -> sources of the cells to run before and after a notebook's cells
+    start = "\n".join([
+        "import os as __dd_os, cProfile as __dd_cProfile",
+        f"__dd_os.environ[{PROFILE_DIR_ENV!r}] = {profile_dir!r}",  # for the registered commands the notebook runs
+        "__dd_profiler = __dd_cProfile.Profile()",
+        "__dd_profiler.enable()",
+    ])
+    stop = "\n".join([
+        "__dd_profiler.disable()",
+        f"__dd_profiler.dump_stats({os.path.join(profile_dir, KERNEL_PROFILE)!r})",
+        f"__dd_os.environ.pop({PROFILE_DIR_ENV!r}, None)",
+        "del __dd_os, __dd_cProfile, __dd_profiler",
+    ])
+    return start, stop
+
+def load_profile(profile_dir: str):
+    """The stats of all the processes that saved some into profile_dir, added up, or None if none did."""
+    import pstats
+    files = sorted(str(f) for f in Path(profile_dir).glob("*.prof"))
+    return pstats.Stats(*files) if files else None
+
+def function_times(stats):
+    """{(file, name): [own seconds, cumulative seconds]}"""
+    times = {}
+    for (file, _, name), (_, _, tt, ct, _) in stats.stats.items():
+        entry = times.setdefault((file, name), [0.0, 0.0])
+        entry[0] += tt
+        entry[1] += ct
+    return times
+
+def function_label(function: tuple):
+    file, name = function
+    if file == "~":  # built-in
+        return name
+    path = os.path.relpath(file) if not os.path.relpath(file).startswith("..") else os.path.basename(file)
+    return f"{path}({name})"
+
+def profile_growth(accepted: dict, current: dict, tolerance: float, min_time: float):
+    """[(function, accepted seconds, current seconds)] of the functions whose cumulative time grew.
+
+    The callers of a function that grew grow as much, so those whose own time grew most come first.
+    """
+    grown = []
+    for function, (_, new) in current.items():
+        old = accepted.get(function, (0.0, 0.0))[1]
+        if new > old * (1 + tolerance) and new - old > min_time:
+            grown.append((function, old, new))
+    own_growth = lambda g: current[g[0]][0] - accepted.get(g[0], (0.0, 0.0))[0]
+    return sorted(grown, key=lambda g: (-own_growth(g), g[1] - g[2]))
+
+def profile_report(profiles: dict, top: int):
+    """Lines of a report of the hottest functions over all demos, and of those whose time grew.
+
+    profiles holds, by script file, the function_times of each demo and its profile_growth.
+    """
+    functions = {}
+    grown = {}
+    for times, growth in profiles.values():
+        for function, (tt, ct) in times.items():
+            entry = functions.setdefault(function, [0.0, 0.0, 0])
+            entry[0] += tt
+            entry[1] += ct
+            entry[2] += 1
+        for function, old, new in growth:
+            entry = grown.setdefault(function, [0.0, 0.0, 0])
+            entry[0] += old
+            entry[1] += new
+            entry[2] += 1
+    lines = [f"Hottest functions of {len(profiles)} demos:", f"{'cumulative':>12} {'own':>10} {'demos':>6}  function"]
+    for function, (tt, ct, count) in sorted(functions.items(), key=lambda item: -item[1][1])[:top]:
+        lines.append(f"{ct * 1000:10.1f}ms {tt * 1000:8.1f}ms {count:6}  {function_label(function)}")
+    if grown:
+        lines.append("Functions whose cumulative time grew since the accepted profiles:")
+        for function, (old, new, count) in sorted(grown.items(), key=lambda item: item[1][0] - item[1][1])[:top]:
+            lines.append(f"{old * 1000:10.1f}ms -> {new * 1000:.1f}ms in {count} demos  {function_label(function)}")
+    return lines
+
+@contextmanager
+def profile_shims():
+    """Puts a shim that runs through toprof ahead on PATH for each [coverage-cli] command, while profiling."""
+    from demo_driven.ddcov import cli_shims  # ddcov imports ddrun, which imports this module
+    with cli_shims("from demo_driven.ddprof import toprof; toprof()") as shim_dir:
+        yield shim_dir
+
+def toprof():
+    """Runs a [coverage-cli] command under cProfile, saving its stats into the profile directory of the demo."""
+    from demo_driven.ddcov import COVERAGE_SECTION, ini_coverage_section, run_cli
+    args = sys.argv[1:]
+    if not args or args[0] not in ini_coverage_section():
+        print(f"toprof: command {args[0] if args else ''!r} not registered in [{COVERAGE_SECTION}] of demo_driven.ini")
+        sys.exit(1)
+    if not (profile_dir := os.environ.get(PROFILE_DIR_ENV)):  # run outside a profiled demo
+        return run_cli(args[0], args[1:])
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        run_cli(args[0], args[1:])
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(profile_dir, f"{args[0]}-{os.getpid()}.prof"))
@@ -6,31 +6,50 @@ import configparser
 import subprocess
 import re
 import shlex
-import fnmatch
-import difflib
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import shutil
+import importlib.util
+from functools import lru_cache
+from contextlib import contextmanager, nullcontext, closing
+from demo_driven.normalize import BUILTIN_RULES, compile_rules, normalize_lines
+from demo_driven.discover import compile_patterns, scan_tree
+from demo_driven.runners import BUILTIN_RUNNERS, plugin_runners, load_runner
+# the modules of notebooks, diffs, the zygote, --profile and --profile-imports are imported where they are used,
+# so that running a .py demo costs little more than starting Python
 
 import logging
 logger = logging.getLogger(__name__)
 
-try:
-    import nbformat
-    from nbclient import NotebookClient
-    JUPYTER_AVAILABLE = True
-except ImportError:
-    JUPYTER_AVAILABLE = False
+# nbformat and nbclient are imported by the functions that run notebooks, when a notebook runs
+JUPYTER_AVAILABLE = all(importlib.util.find_spec(name) is not None for name in ("nbformat", "nbclient"))
 
 if sys.platform.startswith("win"):  # nbclient issue #128, pyzmq issue #1554
     import asyncio
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
 TARGET_DIR_FILE = Path(".dddir")
+CACHE_DIR = Path(".ddcache")
+RUNTIMES_FILE = CACHE_DIR / "runtimes.json"
+RESULTS_FILE = CACHE_DIR / "results.json"
+IMPACT_FILE = CACHE_DIR / "impact.json"
+MANIFEST_FILE = CACHE_DIR / "manifest.json"
+INDEX_FILE = CACHE_DIR / "index.json"
+RUNNERS_FILE = CACHE_DIR / "runners.json"
+NOTEBOOK_SCRIPTS_DIR = CACHE_DIR / "notebooks"
 DEFAULT_TEXT_ENCODING = "utf-8"
+SHIM_DIR_ENV = "DDCOV_SHIMS"  # set by ddcov --shims
 
 def get_shell_env():
     """Creates a shell environment with the virtualenv bin/Scripts path prepended to PATH."""
     shell_env = os.environ.copy()
     shell_env.setdefault("PYTHONUTF8", "1")
     shell_env.setdefault("PYTHONIOENCODING", DEFAULT_TEXT_ENCODING)
+    # set for ddrun --profile-imports; a ddrun run by a demo must not save import times in its own outputs
+    shell_env.pop("PYTHONPROFILEIMPORTTIME", None)
 
     # Determine the correct directory name for executables
     exe_dir = "Scripts" if sys.platform.startswith("win") else "bin"
@@ -38,6 +57,9 @@ def get_shell_env():
 
     # Prepend the virtualenv path to the PATH environment variable
     shell_env["PATH"] = f"{venv_exe_path}{os.pathsep}{shell_env.get('PATH', '')}"
+    # ddcov's coverage shims must stay ahead of the real executables, at any nesting depth
+    if shim_dir := shell_env.get(SHIM_DIR_ENV):
+        shell_env["PATH"] = f"{shim_dir}{os.pathsep}{shell_env['PATH']}"
     return shell_env
 
 PYTHON_UTF8_ENV = get_shell_env()
@@ -67,137 +89,1211 @@ def set_or_show_target_dir(demo_dir: str, args_dir: str, extra_ignored: bool):
     else:
         print(f'Current target directory: "{demo_dir}"')
 
+INI_FILE = Path("demo_driven.ini")
+
 def read_demo_driven_ini():
     config = configparser.ConfigParser()
-    ini = Path("demo_driven.ini")
-    if ini.exists():
-        config.read(ini, encoding=DEFAULT_TEXT_ENCODING)
+    if INI_FILE.exists():
+        config.read(INI_FILE, encoding=DEFAULT_TEXT_ENCODING)
     return config
 
-demo_driven_config = read_demo_driven_ini()
+@lru_cache(maxsize=None)
+def demo_driven_config():  # parsed on first use, since some commands never need it
+    return read_demo_driven_ini()
 
 def ini_bash_path():
-    if "bash" in demo_driven_config:
-        bash_section = demo_driven_config["bash"]
+    if "bash" in demo_driven_config():
+        bash_section = demo_driven_config()["bash"]
         if "command" in bash_section:
             return shlex.split(bash_section["command"])
     return ["bash"]
 
-BASH = ini_bash_path()
+def reload_demo_driven_ini():
+    demo_driven_config.cache_clear()
+
+PARALLEL_SECTION = "parallel"
+
+def ini_serial_patterns():
+    if PARALLEL_SECTION in demo_driven_config():
+        return demo_driven_config()[PARALLEL_SECTION].get("serial", "").split()
+    return []
+
+CACHE_SECTION = "cache"
+CACHE_ENV = ["PYTHONPATH", "PYTHONHASHSEED", "PYTHONUTF8", "PYTHONIOENCODING", "LANG", "LC_ALL", "TZ"]
+
+def ini_cache_option(key: str):
+    if CACHE_SECTION in demo_driven_config():
+        return demo_driven_config()[CACHE_SECTION].get(key, "").split()
+    return []
+
+PRELOAD_SECTION = "preload"
+
+def ini_preload_option(key: str):
+    if PRELOAD_SECTION in demo_driven_config():
+        return demo_driven_config()[PRELOAD_SECTION].get(key, "").split()
+    return []
+
+METRICS_SECTION = "metrics"
+
+def ini_metrics_option(key: str, default: float):
+    if METRICS_SECTION in demo_driven_config():
+        return demo_driven_config()[METRICS_SECTION].getfloat(key, default)
+    return default
+
+PROFILE_SECTION = "profile"
+
+def ini_profile_option(key: str, default: float):
+    if PROFILE_SECTION in demo_driven_config():
+        return demo_driven_config()[PROFILE_SECTION].getfloat(key, default)
+    return default
+
+DIFF_SECTION = "diff"
+
+def ini_diff_option(key: str, default: int):
+    if DIFF_SECTION in demo_driven_config():
+        return demo_driven_config()[DIFF_SECTION].getint(key, default)
+    return default
+
+DISCOVER_SECTION = "discover"
+IGNORED_DIRS = [".*", "__pycache__", ".ipynb_checkpoints"]
+
+def ini_discover_recursive():
+    if DISCOVER_SECTION in demo_driven_config():
+        return demo_driven_config()[DISCOVER_SECTION].getboolean("recursive", False)
+    return False
+
+def ini_discover_ignore():
+    if DISCOVER_SECTION in demo_driven_config():
+        return demo_driven_config()[DISCOVER_SECTION].get("ignore", "").split()
+    return []
+
+NOTEBOOKS_SECTION = "notebooks"
+
+def ini_notebooks_kernel_free():
+    if NOTEBOOKS_SECTION in demo_driven_config():
+        return demo_driven_config()[NOTEBOOKS_SECTION].getboolean("kernel_free", False)
+    return False
 
+MIME_SECTION = "mime"
+
+def ini_mime_policies():
+    """Policies of [mime] by kind or pattern, followed by the defaults they do not override."""
+    from demo_driven.nbdigest import MIME_POLICIES, DEFAULT_MIME_POLICIES
+    policies = {}
+    if MIME_SECTION in demo_driven_config():
+        for kind, policy in demo_driven_config()[MIME_SECTION].items():
+            if policy not in MIME_POLICIES:
+                raise ValueError(f"demo_driven.ini: [{MIME_SECTION}] {kind} = {policy}, expected one of {', '.join(MIME_POLICIES)}")
+            policies[kind] = policy
+    return policies | {kind: policy for kind, policy in DEFAULT_MIME_POLICIES.items() if kind not in policies}
+
+NORMALIZE_SECTION = "normalize"
+
+def ini_normalize_rules(script_file: Path):
+    """(name, regex) rules of [normalize], followed by those of each [normalize:PATTERN] section matching the demo."""
+    rules = {}
+    for section in demo_driven_config().sections():
+        name, _, pattern = section.partition(":")
+        if name != NORMALIZE_SECTION or pattern and not match_pattern(pattern.strip(), [script_file]):
+            continue
+        for key, value in demo_driven_config()[section].items():
+            if key == "rules":
+                for builtin in value.split():
+                    if builtin not in BUILTIN_RULES:
+                        raise ValueError(f"demo_driven.ini: [{section}] unknown rule {builtin}, expected one of {', '.join(BUILTIN_RULES)}")
+                    rules[builtin] = BUILTIN_RULES[builtin]
+            else:
+                rules[key] = value
+    return tuple(rules.items())
+
+def demo_normalizer(script_file: Path):
+    return compile_rules(ini_normalize_rules(script_file))
+
+# each rule is a run of consecutive lines to drop, one regex per line, matched at the start of the line
 SUPPRESSED_PATTERNS = [
-    re.compile(r"^.*Assertion failed: .+ \[\d+\] \(.+?:\d+\).*\n?", re.MULTILINE)
+    (re.compile(r".*Assertion failed: .+ \[\d+\] \(.+?:\d+\)"),),
+    (re.compile(r".*coverage.control.py:\d+: CoverageWarning: No data was collected"), re.compile(r"\s+self._warn\(.*\)")),
 ]
 
 def read_notebook(ipynb_file: Path):
+    import nbformat
     return nbformat.read(ipynb_file, as_version=4)
 
 def save_notebook(nb, ipynb_file: Path):
-    nbformat.write(nb, ipynb_file)
+    """Writes the notebook to a temporary file first, so an interrupted write never leaves it truncated."""
+    import nbformat
+    new_file = ipynb_file.with_name(f".{ipynb_file.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        nbformat.write(nb, new_file)
+        new_file.replace(ipynb_file)
+    except BaseException:
+        new_file.unlink(missing_ok=True)
+        raise
+
+def kernel_pool(size: int):
+    if not size or not JUPYTER_AVAILABLE:
+        return nullcontext()
+    from demo_driven.kernelpool import KernelPool
+    return KernelPool(size)
 
-def execute_notebook(nb):
+def execute_notebook(nb, pool=None, timing: dict = None):
+    for _ in execute_notebook_cells(nb, pool, timing):
+        pass
+
+def execute_notebook_cells(nb, pool=None, timing: dict = None):
+    """Executes the notebook like NotebookClient.execute(), yielding each code cell as soon as it has finished.
+
+    With a KernelPool the kernel is leased from it, unless the notebook asks for isolation.
+    When timing is given, the seconds spent starting the kernel and executing cells are stored in it.
+    """
+    from nbclient import NotebookClient
+    from demo_driven.kernelpool import needs_isolation
+    start = time.perf_counter()
+    km = None
+    if pool is None or needs_isolation(nb):
+        client = NotebookClient(nb)
+        client.create_kernel_manager()
+        client.start_new_kernel()
+    else:
+        km = pool.lease(nb)
+        client = NotebookClient(nb, km=km)
+    started = None
+    try:
+        client.start_new_kernel_client()
+        started = time.perf_counter()
+        with client.setup_kernel():
+            info_msg = client.wait_for_reply(client.kc.kernel_info())
+            if info_msg is not None:
+                nb.metadata["language_info"] = info_msg["content"]["language_info"]
+            for index, cell in enumerate(nb.cells):
+                client.execute_cell(cell, index, execution_count=client.code_cells_executed + 1)
+                if km is not None:  # a reused kernel keeps counting, so number outputs like a fresh one
+                    for output in cell.get("outputs", []):
+                        if "execution_count" in output:
+                            output.execution_count = cell.execution_count
+                if cell.cell_type == "code":
+                    yield cell
+            client.set_widgets_metadata()
+    finally:
+        if km is not None:
+            if client.kc is not None:
+                client.kc.stop_channels()
+            pool.release(nb, km)
+        if timing is not None:
+            end = time.perf_counter()
+            timing["kernel"] = (started or end) - start
+            timing["cells"] = end - (started or end)
+
+async def async_execute_notebook_cells(nb, timing: dict = None):
+    """Like execute_notebook_cells, but on the running event loop and always on a kernel of its own.
+
+    Cancelling the task that iterates it shuts the kernel down. Unlike setup_kernel(), no signal
+    handlers are installed, so Ctrl+C cancels the tasks of the event loop instead of killing kernels.
+    """
+    from nbclient import NotebookClient
+    start = time.perf_counter()
     client = NotebookClient(nb)
-    client.execute()
+    client.create_kernel_manager()
+    started = None
+    try:
+        await client.async_start_new_kernel()
+        await client.async_start_new_kernel_client()
+        started = time.perf_counter()
+        info_msg = await client.async_wait_for_reply(client.kc.kernel_info())
+        if info_msg is not None:
+            nb.metadata["language_info"] = info_msg["content"]["language_info"]
+        for index, cell in enumerate(nb.cells):
+            await client.async_execute_cell(cell, index, execution_count=client.code_cells_executed + 1)
+            if cell.cell_type == "code":
+                yield cell
+        client.set_widgets_metadata()
+    finally:
+        if client.kc is not None:
+            client.kc.stop_channels()
+        if client.km.has_kernel:
+            await client.km.shutdown_kernel(now=True)
+        if timing is not None:
+            end = time.perf_counter()
+            timing["kernel"] = (started or end) - start
+            timing["cells"] = end - (started or end)
 
 def notebook_outputs(nb):
     return [notebook_cell_output_text(cell) for cell in nb.cells if cell.cell_type == "code"]
 
 def notebook_cell_output_text(cell):
-    text = ''
+    parts = []
     prev_type = None
     for output in cell.get("outputs", []):
         if prev_type is not None and prev_type != output.output_type:
-            text += "\n"
+            parts.append("\n")
         if output.output_type == "stream":
-            text += output.text
+            parts.append(output.text)
         elif output.output_type in ("execute_result", "display_data"):
-            text += output.get("data", {}).get("text/plain", '')
+            parts.append(output.get("data", {}).get("text/plain", ''))
         elif output.output_type == "error":
-            text += "\n".join(output.get("traceback", []))
+            parts.append("\n".join(output.get("traceback", [])))
         prev_type = output.output_type
-    return text
+    return "".join(parts)
+
+SCRIPT_FORMAT = "1"  # bump when notebook_script() changes, so cached scripts are generated again
+
+def kernel_free_script(ipynb_file: Path, nb):  # -> script file and marker, or None if the notebook needs a kernel
+    """Converts the notebook into a script once; the result is cached under the hash of the notebook."""
+    from demo_driven.nbscript import NEEDS_KERNEL, notebook_script
+    sha256 = hashlib.sha256(ipynb_file.read_bytes() + SCRIPT_FORMAT.encode()).hexdigest()
+    script_file = NOTEBOOK_SCRIPTS_DIR / f"{sha256}.py"
+    marker = f"\x1edd-{sha256[:16]}\x1e"  # cannot occur in the output of a notebook that does not print its own hash
+    try:
+        source = script_file.read_text(encoding=DEFAULT_TEXT_ENCODING)
+    except OSError:
+        source, reason = notebook_script(nb, marker, ipynb_file.name)
+        source = source or f"{NEEDS_KERNEL}{reason}\n"
+        NOTEBOOK_SCRIPTS_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = script_file.with_name(f"{script_file.name}.{os.getpid()}.{threading.get_ident()}")
+        tmp.write_text(source, encoding=DEFAULT_TEXT_ENCODING)
+        tmp.replace(script_file)
+    if source.startswith(NEEDS_KERNEL):
+        logger.debug(f"{demo_label(ipynb_file)}: {source[2:].strip()}")
+        return None
+    return script_file, marker
+
+def run_kernel_free(ipynb_file: Path, nb, loaded_modules: list = None, zygote: str = None, timing: dict = None, metrics: dict = None, control: dict = None):
+    """Runs the notebook as a script and returns the text of its outputs, or None if it has to run on a kernel.
+
+    The output is held back until the script has finished, so nothing is yielded from a run that falls back.
+    """
+    from demo_driven.nbscript import cell_outputs
+    if (script := kernel_free_script(ipynb_file, nb)) is None:
+        return None
+    script_file, marker = script
+    start = time.perf_counter()
+    modules = [] if loaded_modules is not None else None
+    run_metrics = {}
+    if is_cold_start(ipynb_file):
+        zygote = None
+    output = "".join(stream_output(script_file, modules, zygote, metrics=run_metrics, control=control))
+    code_cells = sum(1 for cell in nb.cells if cell.cell_type == "code")
+    if run_metrics.get("returncode") != 0 or (cells := cell_outputs(output, marker, code_cells)) is None:
+        logger.debug(f"{demo_label(ipynb_file)}: falling back to a kernel")
+        return None
+    if loaded_modules is not None:
+        loaded_modules.extend(m for m in modules if m != os.path.realpath(script_file))
+    if timing is not None:
+        timing["kernel"] = 0.0
+        timing["cells"] = time.perf_counter() - start
+    if metrics is not None:
+        metrics.update(run_metrics)
+    return "\n".join(cells)
+
+LOCAL_MODULES_CELL = "from demo_driven.ddexec import local_module_files as __dd_modules\nprint(__import__('json').dumps(__dd_modules()))"
+
+def notebook_runs_shell(nb):
+    for cell in nb.cells:
+        if cell.cell_type == "code":
+            lines = [line.strip() for line in cell.source.splitlines()]
+            if any(line.startswith(("!", "%%bash", "%%sh", "%%script", "%sx", "%system")) for line in lines):
+                return True
+    return False
+
+@contextmanager
+def start_zygote(modules: list[str]):
+    """Starts a fork server with the modules preloaded and yields its socket path, or None if fork is unavailable."""
+    from demo_driven.zygote import is_supported as fork_supported
+    if not fork_supported():
+        yield None
+        return
+    tmp_dir = tempfile.mkdtemp(prefix="ddrun-")
+    socket_path = os.path.join(tmp_dir, "zygote.sock")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "demo_driven.zygote", socket_path] + modules,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        text=True,
+        encoding=DEFAULT_TEXT_ENCODING,
+        env=PYTHON_UTF8_ENV
+    )
+    try:
+        yield socket_path if proc.stdout.readline().strip() == "ready" else None
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def is_cold_start(script_file: Path):
+    return any(match_pattern(pattern, [script_file]) for pattern in ini_preload_option("cold"))
+
+def stream_from_zygote(zygote: str, script_file: Path, modules_file: str = None, metrics: dict = None, control: dict = None):
+    import socket
+    import signal
+    request = {"script": str(script_file), "cwd": os.getcwd(), "env": PYTHON_UTF8_ENV, "record_modules": modules_file}
+    read_fd, write_fd = os.pipe()
+    with open(read_fd, encoding=DEFAULT_TEXT_ENCODING) as reader, socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(zygote)
+            socket.send_fds(sock, [json.dumps(request).encode()], [write_fd])
+        finally:
+            os.close(write_fd)
+        with sock.makefile("rb") as status:
+            pid = json.loads(status.readline())["pid"]
+            if control is not None:
+                control["kill"] = lambda: os.kill(pid, signal.SIGKILL)
+            finished = False
+            try:
+                yield from reader
+                finished = True
+            finally:
+                if control is not None:
+                    control.pop("kill", None)
+                if not finished:
+                    os.kill(pid, signal.SIGKILL)
+            # exit status and resource usage, sent once the child has finished; nothing if it called os._exit()
+            line = status.readline()
+            if metrics is not None:
+                metrics.update(json.loads(line) if line else {"returncode": None})
+
+def process_metrics(proc: subprocess.Popen, metrics: dict):
+    """Reaps the finished process, storing its exit code and, where wait4() exists, its CPU time and peak RSS."""
+    if not hasattr(os, "wait4"):
+        metrics["returncode"] = proc.wait()
+        return
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)  # so that Popen does not wait for it again
+    metrics["returncode"] = proc.returncode
+    metrics["cpu"] = usage.ru_utime + usage.ru_stime
+    metrics["peak_rss"] = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+def stream_process(args: list, env: dict, metrics: dict = None, control: dict = None):
+    with subprocess.Popen(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        encoding=DEFAULT_TEXT_ENCODING,
+        env=env
+    ) as proc:
+        if control is not None:
+            control["kill"] = proc.kill
+        try:
+            yield from proc.stdout
+            if metrics is not None:
+                process_metrics(proc, metrics)
+        finally:
+            if control is not None:
+                control.pop("kill", None)
+            if proc.poll() is None:  # closed before the end of its output
+                proc.kill()
+
+def stream_python(script_file: Path, loaded_modules: list = None, zygote: str = None, metrics: dict = None, control: dict = None, env: dict = PYTHON_UTF8_ENV, profile_file: str = None):
+    modules_file = None
+    if loaded_modules is not None:
+        fd, modules_file = tempfile.mkstemp(prefix="ddrun-", suffix=".json")
+        os.close(fd)
+    try:
+        if zygote is not None and not is_cold_start(script_file):
+            yield from stream_from_zygote(zygote, script_file, modules_file, metrics, control)
+        elif modules_file is None and profile_file is None:
+            yield from stream_process([sys.executable, script_file], env, metrics, control)
+        else:
+            options = (["--record-modules", modules_file] if modules_file else []) + (["--profile", profile_file] if profile_file else [])
+            yield from stream_process([sys.executable, "-m", "demo_driven.ddexec"] + options + [script_file], env, metrics, control)
+    finally:
+        if loaded_modules is not None:
+            try:
+                loaded_modules.extend(json.loads(Path(modules_file).read_text(encoding=DEFAULT_TEXT_ENCODING)))
+            except ValueError:  # the script ended with os._exit() or was killed
+                loaded_modules.append(None)
+            Path(modules_file).unlink(missing_ok=True)
+
+def traced_env(env: dict, imports: list = None, profile_dir: str = None):
+    if imports is not None:
+        from demo_driven.importtime import IMPORT_TIME_ENV
+        env = env | IMPORT_TIME_ENV
+    if profile_dir is not None:
+        from demo_driven.ddprof import PROFILE_DIR_ENV
+        env = env | {PROFILE_DIR_ENV: profile_dir}
+    return env
+
+def run_python_demo(script_file: Path, env: dict, metrics: dict = None, control: dict = None, loaded_modules: list = None, zygote: str = None, imports: list = None, profile_dir: str = None, **options):
+    if imports is None and profile_dir is None:
+        yield from stream_python(script_file, loaded_modules, zygote, metrics, control, env)
+        return
+    profile_file = os.path.join(profile_dir, "demo.prof") if profile_dir is not None else None
+    chunks = stream_python(script_file, loaded_modules, None, metrics, control, traced_env(env, imports, profile_dir), profile_file)
+    yield from without_import_times(chunks, imports)
+
+def run_shell_demo(script_file: Path, env: dict, metrics: dict = None, control: dict = None, imports: list = None, profile_dir: str = None, **options):
+    chunks = stream_process(ini_bash_path() + [script_file], traced_env(env, imports, profile_dir), metrics, control)
+    yield from without_import_times(chunks, imports)
+
+def without_import_times(chunks, imports: list = None):
+    if imports is None:
+        return chunks
+    from demo_driven.importtime import strip_import_times
+    return strip_import_times(split_lines(chunks), imports)
+
+def run_notebook_demo(script_file: Path, env: dict, metrics: dict = None, control: dict = None, loaded_modules: list = None, zygote: str = None, pool=None, timing: dict = None, profile_dir: str = None, **options):
+    import nbformat
+    nb = read_notebook(script_file)
+    if ini_notebooks_kernel_free() and profile_dir is None:
+        if (output := run_kernel_free(script_file, nb, loaded_modules, zygote, timing, metrics, control)) is not None:
+            yield output
+            return
+        if control is not None and control.get("cancelled"):
+            return
+    modules_cell = None
+    added_cells = []
+    if profile_dir is not None:
+        from demo_driven.ddprof import profile_cells
+        start, stop = profile_cells(profile_dir)
+        nb.cells.insert(0, nbformat.v4.new_code_cell(start))
+        nb.cells.append(nbformat.v4.new_code_cell(stop))
+        added_cells = [nb.cells[0], nb.cells[-1]]
+    if loaded_modules is not None:
+        nb.cells.append(modules_cell := nbformat.v4.new_code_cell(LOCAL_MODULES_CELL))
+    separator = ""
+    with closing(execute_notebook_cells(nb, pool, timing)) as cells:
+        for cell in cells:
+            if cell is modules_cell:
+                loaded_modules.extend(json.loads(cell.outputs[0].text))
+            elif any(cell is added for added in added_cells):
+                continue
+            else:  # same text as "\n".join(notebook_outputs(nb))
+                yield separator + notebook_cell_output_text(cell)
+                separator = "\n"
+    if metrics is not None:  # the kernel is not our child, so only wall time is measured
+        metrics["returncode"] = 0
+
+@lru_cache(maxsize=None)
+def demo_runners():  # -> {suffix: "module:function"}, built-in first
+    plugins, updated = plugin_runners(load_cache_file(RUNNERS_FILE))
+    if updated is not None:
+        save_cache_file(RUNNERS_FILE, updated)
+    return BUILTIN_RUNNERS | dict(sorted(plugins.items()))
+
+@lru_cache(maxsize=None)
+def demo_runner(suffix: str):
+    return load_runner(demo_runners()[suffix])
+
+def stream_output(script_file: Path, loaded_modules: list = None, zygote: str = None, pool=None, timing: dict = None, metrics: dict = None, control: dict = None, imports: list = None, profile_dir: str = None):
+    """Runs a demo through the runner of its suffix and yields its output in chunks as it is produced; closing the generator stops the demo.
+
+    When loaded_modules is given, the local modules the demo loaded are appended to it once it has finished.
+    When metrics is given, the exit code, CPU time and peak RSS are stored in it if the demo runs to the end.
+    When control is given, a function that kills the demo's process is stored in it under "kill" while it runs.
+    When imports is given, .py and .sh demos run with import-time tracing, whose records are appended to it
+    instead of being part of the output; .py demos then bypass the zygote, which has imported ahead of them.
+    When profile_dir is given, the demo and the registered commands it runs save their cProfile stats into it;
+    .py demos bypass the zygote, and notebooks run on a kernel.
+    """
+    env = get_shell_env()  # with the shims that profile_shims put on PATH
+    options = {"loaded_modules": loaded_modules, "zygote": zygote, "pool": pool, "timing": timing, "imports": imports, "profile_dir": profile_dir}
+    yield from demo_runner(script_file.suffix)(script_file, env, metrics, control, **options)
+
+def split_lines(chunks):
+    """Regroups chunks of text into lines that keep their "\n"; the last line may lack it."""
+    pending = ""
+    for chunk in chunks:
+        *lines, pending = (pending + chunk).split("\n")
+        for line in lines:
+            yield line + "\n"
+    if pending:
+        yield pending
+
+def suppress_lines(lines, rules=SUPPRESSED_PATTERNS):
+    window = max((len(rule) for rule in rules), default=1)
+    buffered = []
+
+    def drop_or_emit():
+        for rule in rules:
+            if len(rule) <= len(buffered) and all(pattern.match(line) for pattern, line in zip(rule, buffered)):
+                logger.debug(f"suppressed {buffered[:len(rule)]!r}")
+                del buffered[:len(rule)]
+                return None
+        return buffered.pop(0)
+
+    for line in lines:
+        buffered.append(line)
+        if len(buffered) >= window and (line := drop_or_emit()) is not None:
+            yield line
+    while buffered:
+        if (line := drop_or_emit()) is not None:
+            yield line
+
+def filtered_output(chunks, normalize=None):
+    """Lines of output with the suppressed ones dropped and, given a normalizer, the rest normalized, in a single pass."""
+    lines = suppress_lines(split_lines(chunks))
+    return normalize_lines(lines, normalize) if normalize else lines
+
+class DemoCancelled(Exception):
+    pass
+
+def cancellable(chunks, control: dict):
+    for chunk in chunks:
+        if control.get("cancelled"):
+            raise DemoCancelled
+        yield chunk
+    if control.get("cancelled"):  # killed, so the output ended early
+        raise DemoCancelled
+
+def cancel_demo(control: dict):
+    """Stops a demo run with this control from another thread; notebooks stop after the running cell."""
+    control["cancelled"] = True
+    if kill := control.get("kill"):
+        try:
+            kill()
+        except ProcessLookupError:
+            pass
+
+def run_demo(script_file: Path, loaded_modules: list = None, zygote: str = None, pool=None, timing: dict = None, fail_fast=False, metrics: dict = None, control: dict = None, digest: dict = None, imports: list = None, profile_dir: str = None):
+    """Runs a demo while streaming its output into its .txt file; returns the state and message of save_output.
+
+    When control is given, cancel_demo(control) makes it raise DemoCancelled, leaving the saved files untouched.
+    """
+    with closing(stream_output(script_file, loaded_modules, zygote, pool, timing, metrics, control, imports, profile_dir)) as chunks:
+        lines = filtered_output(chunks if control is None else cancellable(chunks, control), demo_normalizer(script_file))
+        return save_output(script_file, lines, fail_fast, digest)
 
 def run_script(script_file: Path):
+    print(run_demo(script_file)[1])
+
+def is_cacheable(script_file: Path):
+    if any(match_pattern(pattern, [script_file]) for pattern in ini_cache_option("exclude")):
+        return False
     match script_file.suffix:
         case ".py":
-            output = subprocess.run(
-                [sys.executable, script_file],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                encoding=DEFAULT_TEXT_ENCODING,
-                env=PYTHON_UTF8_ENV
-            ).stdout
-        case ".ipynb":
-            nb = read_notebook(script_file)
-            execute_notebook(nb)
-            output = "\n".join(notebook_outputs(nb))
-        case ".sh":
-            output = subprocess.run(
-                BASH + [script_file],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                encoding=DEFAULT_TEXT_ENCODING,
-                env=get_shell_env()
-            ).stdout
-    logger.debug(f"before {output!r}")
-    for pattern in SUPPRESSED_PATTERNS:
-        output = pattern.sub("", output)
-    logger.debug(f"after  {output!r}")
-    save_output_and_diff(script_file, output)
+            return True
+        case ".ipynb":  # modules loaded by shell commands cannot be recorded
+            return not notebook_runs_shell(read_notebook(script_file))
+    return False
 
-def save_output_and_diff(script_file: Path, output: str):
+def demo_fingerprint(script_file: Path, module_files: list):
+    """Hashes everything a confirmed result depends on, or returns None if some of it is gone."""
+    h = hashlib.sha256()
+    for name in CACHE_ENV + ini_cache_option("env"):
+        h.update(f"{name}={PYTHON_UTF8_ENV.get(name, '')}\0".encode())
+    h.update(f"{sys.executable}\0{sys.version}\0".encode())
+    out_file = script_file.with_name(script_file.name + ".txt")
+    for file in [script_file, out_file] + sorted(module_files, key=str):
+        if file is None:
+            return None
+        h.update(f"{file}\0".encode())
+        try:
+            h.update(Path(file).read_bytes())
+        except OSError:
+            return None
+    return h.hexdigest()
+
+def is_cached(script_file: Path, results: dict):
+    entry = results.get(runtime_key(script_file))
+    if entry is None or any(script_file.with_name(script_file.name + suffix).exists() for suffix in [".tx~", ".metrics.jso~"]):
+        return False
+    return demo_fingerprint(script_file, entry["modules"]) == entry["fingerprint"]
+
+def save_output(script_file: Path, lines, fail_fast=False, digest: dict = None):  # -> state, message
+    """Writes the lines to the .txt file while comparing them with the baseline, without holding either in memory.
+
+    With fail_fast, stops reading at the first difference and leaves the existing files untouched,
+    returning the state "stopped".
+    When digest is given, the sha256 of the output saved in the .txt file is stored in it under "sha256".
+    """
     out_file = script_file.with_name(script_file.name + ".txt")
     old_file = script_file.with_name(script_file.name + ".tx~")
     html_file = script_file.with_name(script_file.name + ".html")
-    if not out_file.exists():
-        out_file.write_text(output, encoding=DEFAULT_TEXT_ENCODING)
-        print(f"{script_file.name}: output saved")
-    else:
+    baseline_file = old_file if old_file.exists() else out_file if out_file.exists() else None
+    new_file = script_file.with_name(f".{script_file.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with (
+        open(new_file, "w", encoding=DEFAULT_TEXT_ENCODING) as new,
+        open(baseline_file, encoding=DEFAULT_TEXT_ENCODING) if baseline_file else nullcontext() as baseline
+    ):
+        try:
+            changed = stopped = False
+            h = hashlib.sha256() if digest is not None else None
+            for line in lines:
+                new.write(line)
+                if h is not None:
+                    h.update(line.encode(DEFAULT_TEXT_ENCODING))
+                # reading as many characters as the line has keeps the comparison independent of line breaks
+                if baseline is not None and not changed and baseline.read(len(line)) != line:
+                    changed = True
+                    if stopped := fail_fast:
+                        break
+            if baseline is not None and not changed and baseline.read(1):
+                changed = True
+        except BaseException:
+            new.close()
+            new_file.unlink()
+            raise
+    if h is not None and not stopped:
+        digest["sha256"] = h.hexdigest()
+    if baseline_file is None:
+        new_file.replace(out_file)
+        return "saved", f"{demo_label(script_file)}: output saved"
+    if stopped:
+        new_file.unlink()
+        return "stopped", f"{demo_label(script_file)}: output changed, demo stopped at the first difference"
+    if not changed:
+        new_file.unlink()
+        logger.debug(f"{demo_label(script_file)}: output matches saved result")
         if old_file.exists():
-            baseline = old_file.read_text(encoding=DEFAULT_TEXT_ENCODING)
-        else:
-            baseline = out_file.read_text(encoding=DEFAULT_TEXT_ENCODING)
-        if output == baseline:
-            logger.debug(f"{script_file.name}: output matches saved result")
-            print(f"{script_file.name}: output matches saved result")
-            if old_file.exists():
-                old_file.replace(out_file)
-            for f in [html_file, old_file]:
-                f.unlink(missing_ok=True)
+            old_file.replace(out_file)
+        for f in [html_file, old_file]:
+            f.unlink(missing_ok=True)
+        return "matched", f"{demo_label(script_file)}: output matches saved result"
+    if not old_file.exists():
+        out_file.rename(old_file)
+    new_file.replace(out_file)
+    from demo_driven.linediff import make_html  # difflib is only needed once an output changed
+    html = make_html(
+        old_file.read_text(encoding=DEFAULT_TEXT_ENCODING).splitlines(),
+        out_file.read_text(encoding=DEFAULT_TEXT_ENCODING).splitlines(),
+        fromdesc=f"previous output ({old_file.name})",
+        todesc=f"current output ({out_file.name})",
+        context=ini_diff_option("context", 3),
+        max_size=ini_diff_option("max_html_size", 10_000_000)
+    )
+    html_file.write_text(html, encoding=DEFAULT_TEXT_ENCODING)
+    logger.debug(f"{demo_label(script_file)}: output changed, see {html_file.name}")
+    return "changed", f"{demo_label(script_file)}: output changed, see {html_file.name}"
+
+def save_output_and_diff(script_file: Path, output: str):
+    digest = {}
+    state, message = save_output(script_file, filtered_output([output], demo_normalizer(script_file)), digest=digest)
+    previous = load_cache_file(MANIFEST_FILE).get(runtime_key(script_file))
+    save_manifest({runtime_key(script_file): manifest_entry(previous, state, digest.get("sha256"))})
+    print(message)
+    return state
+
+def metrics_regressions(accepted: dict, current: dict):
+    problems = []
+    if current.get("returncode") != accepted.get("returncode"):
+        problems.append(f"exit code {accepted.get('returncode')} -> {current.get('returncode')}")
+    time_tolerance = ini_metrics_option("time_tolerance", 0.5)
+    min_time = ini_metrics_option("min_time", 0.1)
+    memory_tolerance = ini_metrics_option("memory_tolerance", 0.25)
+    for key, label, tolerance, floor, unit, scale in [
+        ("wall", "wall time", time_tolerance, min_time, "s", 1),
+        ("cpu", "CPU time", time_tolerance, min_time, "s", 1),
+        ("peak_rss", "peak RSS", memory_tolerance, 0, " MB", 1 << 20)
+    ]:
+        old, new = accepted.get(key), current.get(key)
+        if old is not None and new is not None and new > old * (1 + tolerance) and new - old > floor:
+            problems.append(f"{label} {old / scale:.2f}{unit} -> {new / scale:.2f}{unit}")
+    return problems
+
+def save_metrics(script_file: Path, metrics: dict):
+    """Keeps .metrics.json and .metrics.jso~ the way save_output keeps .txt and .tx~, and returns a message on regression."""
+    metrics_file = script_file.with_name(script_file.name + ".metrics.json")
+    old_file = script_file.with_name(script_file.name + ".metrics.jso~")
+    text = json.dumps(metrics, indent=1, sort_keys=True)
+    if not metrics_file.exists():
+        metrics_file.write_text(text, encoding=DEFAULT_TEXT_ENCODING)
+        return None
+    baseline = json.loads((old_file if old_file.exists() else metrics_file).read_text(encoding=DEFAULT_TEXT_ENCODING))
+    if problems := metrics_regressions(baseline, metrics):
+        if not old_file.exists():
+            metrics_file.rename(old_file)
+        metrics_file.write_text(text, encoding=DEFAULT_TEXT_ENCODING)
+        return f"{demo_label(script_file)}: metrics exceed tolerance, {', '.join(problems)}"
+    if old_file.exists():
+        old_file.replace(metrics_file)
+    return None
+
+def save_profile(script_file: Path, stats):  # -> function times, the functions that grew, message or None
+    """Keeps .prof and .pro~ the way save_metrics keeps .metrics.json and .metrics.jso~, comparing cumulative times."""
+    import pstats
+    from demo_driven.ddprof import function_times, function_label, profile_growth
+    profile_file = script_file.with_name(script_file.name + ".prof")
+    old_file = script_file.with_name(script_file.name + ".pro~")
+    times = function_times(stats)
+    if not profile_file.exists():
+        stats.dump_stats(profile_file)
+        return times, [], None
+    baseline = function_times(pstats.Stats(str(old_file if old_file.exists() else profile_file)))
+    if grown := profile_growth(baseline, times, ini_profile_option("tolerance", 0.5), ini_profile_option("min_time", 0.1)):
+        if not old_file.exists():
+            profile_file.rename(old_file)
+        stats.dump_stats(profile_file)
+        listed = ", ".join(f"{function_label(function)} {old:.2f}s -> {new:.2f}s" for function, old, new in grown[:3])
+        more = f" and {len(grown) - 3} more" if len(grown) > 3 else ""
+        return times, grown, f"{demo_label(script_file)}: profile grew, {listed}{more}"
+    if old_file.exists():
+        old_file.replace(profile_file)
+    return times, [], None
+
+MANIFEST_STATES = {"saved": "new", "matched": "matched", "changed": "changed", "stopped": "stopped", "failed": "failed"}
+
+def manifest_entry(previous: dict, state: str, sha256: str = None, runtime: float = None, metrics_exceeded=False, profile_grew=False):
+    """What ddrun --status reports for a demo, and what ddrun -a needs to know to skip it."""
+    entry = {"state": MANIFEST_STATES[state], "ran": time.strftime("%Y-%m-%d %H:%M:%S")}
+    if sha256 is None and previous:  # stopped by --fail-fast or failed, so the .txt file is unchanged
+        sha256 = previous.get("sha256")
+    if sha256 is not None:
+        entry["sha256"] = sha256
+    if runtime is not None:
+        entry["runtime"] = round(runtime, 3)
+    if metrics_exceeded:
+        entry["metrics_exceeded"] = True
+    if profile_grew:
+        entry["profile_grew"] = True
+    return entry
+
+def is_pending(entry: dict):
+    # a demo that failed may still have the files of an earlier change; one that was stopped has none
+    return entry["state"] in ("changed", "failed") or entry.get("metrics_exceeded", False) or entry.get("profile_grew", False)
+
+manifest_lock = threading.Lock()
+
+def save_manifest(updates: dict):
+    if updates:
+        with manifest_lock:  # demos finish on several threads under ddrun -j and ddcov -j
+            save_cache_file(MANIFEST_FILE, updates, indent=None)  # saved once per demo, so the fast C encoder
+
+def show_status(script_files: list[Path]):
+    """Reports the state of each demo from the manifest, without running or even opening any demo."""
+    manifest = load_cache_file(MANIFEST_FILE)
+    counts = {}
+    for script_file in script_files:
+        entry = manifest.get(runtime_key(script_file))
+        if entry is None:
+            state = "never run"
+            print(f"{demo_label(script_file)}: never run")
         else:
-            if not old_file.exists():
-                out_file.rename(old_file)
-            out_file.write_text(output, encoding=DEFAULT_TEXT_ENCODING)
-            html = difflib.HtmlDiff().make_file(
-                baseline.splitlines(), output.splitlines(),
-                fromdesc=f"previous output ({old_file.name})",
-                todesc=f"current output ({out_file.name})"
-            )
-            html_file.write_text(html, encoding=DEFAULT_TEXT_ENCODING)
-            logger.debug(f"{script_file.name}: output changed, see {html_file.name}")
-            print(f"{script_file.name}: output changed, see {html_file.name}")
+            state = entry["state"]
+            details = [f"{entry['runtime']:.2f}s" if "runtime" in entry else None, f"ran {entry['ran']}"]
+            if entry.get("profile_grew"):
+                details.insert(0, "profile grew")
+            if entry.get("metrics_exceeded"):
+                details.insert(0, "metrics exceed tolerance")
+            print(f"{demo_label(script_file)}: {state}, {', '.join(filter(None, details))}")
+        counts[state] = counts.get(state, 0) + 1
+    print(", ".join(f"{count} {state}" for state, count in counts.items()) or "no demos")
+
+def accept_scripts(script_files: list[Path], pending_only=False):
+    """Accepts the demos and records them as matched in the manifest, unless their last run failed.
+
+    With pending_only, demos that the manifest lists as neither changed, failed, over their metrics
+    tolerance nor with a grown profile are reported without looking for their files at all.
+    """
+    manifest = load_cache_file(MANIFEST_FILE)
+    updates = {}
+    for script_file in script_files:
+        entry = manifest.get(runtime_key(script_file))
+        if pending_only and entry is not None and not is_pending(entry):
+            print(f"{demo_label(script_file)}: nothing to accept")
+            continue
+        if accept_script(script_file) and entry is not None:
+            state = "failed" if entry["state"] == "failed" else "matched"  # the files were of an earlier run
+            updates[runtime_key(script_file)] = {k: v for k, v in entry.items() if k not in ("metrics_exceeded", "profile_grew")} | {"state": state}
+    save_manifest(updates)
 
 def accept_script(script_file: Path):
     found = False
-    for suffix in [".tx~", ".html"]:
+    for suffix in [".tx~", ".html", ".metrics.jso~", ".pro~"]:
         file = script_file.with_name(script_file.name + suffix)
         if file.exists():
             file.unlink()
             found = True
     if found:
-        print(f"{script_file.name}: accepted")
+        print(f"{demo_label(script_file)}: accepted")
     else:
-        print(f"{script_file.name}: nothing to accept")
+        print(f"{demo_label(script_file)}: nothing to accept")
+    return found
+
+def demo_order():  # -> {suffix: rank} of the suffixes that have a runner
+    return {suffix: f".{rank}" for rank, suffix in enumerate(demo_runners())}
+
+def discover_files(demo_dir: str):
+    """Relative paths of the demo files, from a cached index of the tree when [discover] recursive is on."""
+    if not ini_discover_recursive():
+        return scan_tree(demo_dir, tuple(demo_runners()), ignore=ini_discover_ignore())[0]
+    key = Path(demo_dir).as_posix()
+    suffixes = list(demo_runners())
+    cached = load_cache_file(INDEX_FILE).get(key) or {}
+    # the listings only hold the files of the suffixes they were made for, which change with the runners installed
+    index = cached.get("dirs") if cached.get("suffixes") == suffixes else None
+    found, visited = scan_tree(demo_dir, tuple(suffixes), True, ini_discover_ignore(), IGNORED_DIRS, index)
+    if visited != index:
+        save_cache_file(INDEX_FILE, {key: {"suffixes": suffixes, "dirs": visited}})
+    return found
+
+def glob_sorted(demo_dir: str, order: dict = None):
+    order = {suffix: rank for suffix, rank in (order or demo_order()).items() if suffix != ".ipynb" or JUPYTER_AVAILABLE}
+    def sort_key(path: str):  # demos of the top directory first, then those of each subdirectory
+        directory, _, name = path.rpartition("/")
+        stem, suffix = os.path.splitext(name)
+        return directory, stem + order[suffix]
+
+    paths = [path for path in discover_files(demo_dir) if os.path.splitext(path)[1] in order]
+    demo_paths.update((Path(demo_dir, path), path) for path in paths if "/" in path)
+    return [Path(demo_dir, path) for path in sorted(paths, key=sort_key)]
 
-def glob_sorted(demo_dir: str, order={ ".py":".0", ".ipynb":".1", ".sh":".2" }):
-    if not JUPYTER_AVAILABLE:
-        order.pop(".ipynb", None)
-    return sorted([f for f in Path(demo_dir).glob("*") if f.suffix in order], key=lambda f: f.stem + order[f.suffix])
+demo_paths = {}  # paths relative to the demo directory of the demos found in its subdirectories
+
+def demo_label(script_file: Path):
+    """How messages name a demo: by its file name, or by its path when it was found in a subdirectory."""
+    return demo_paths.get(script_file, script_file.name)
 
 def match_pattern(pattern: str, all_files: list[Path]):
-    return [f for f in all_files if fnmatch.fnmatch(f.name, pattern) or fnmatch.fnmatch(f.stem, pattern)]
+    """The demos whose name or path below the demo directory matches the pattern, with or without suffix."""
+    match = compile_patterns((pattern,))
+    def matches(f: Path):
+        label = demo_label(f)
+        return any(match(os.path.normcase(name)) for name in (f.name, f.stem, label, os.path.splitext(label)[0]))
+    return [f for f in all_files if matches(f)]
+
+def runtime_key(script_file: Path):
+    return script_file.as_posix()
+
+def load_cache_file(cache_file: Path):
+    try:
+        return json.loads(cache_file.read_text(encoding=DEFAULT_TEXT_ENCODING))
+    except:
+        return {}
+
+def file_digest(file):
+    try:
+        return hashlib.sha256(Path(file).read_bytes()).hexdigest()
+    except OSError:
+        return None
+
+def git_changed_files(rev: str):
+    """Absolute paths of the files that differ between rev and the working tree, untracked ones included."""
+    commands = [["git", "rev-parse", "--show-toplevel"], ["git", "diff", "--name-only", rev, "--"], ["git", "ls-files", "--others", "--exclude-standard", "--full-name"]]
+    results = [subprocess.run(command, capture_output=True, text=True, encoding=DEFAULT_TEXT_ENCODING) for command in commands]
+    for result in results:
+        if result.returncode != 0:
+            print(f"ddrun: cannot compare with {rev}: {result.stderr.strip()}")
+            sys.exit(1)
+    top = results[0].stdout.strip()
+    return set(os.path.realpath(os.path.join(top, name)) for result in results[1:] for name in result.stdout.splitlines())
+
+def is_impacted(script_file: Path, impact: dict, changed: set = None):
+    """Whether a file the demo ran when ddcov last measured it differs from the revision, or else from its recorded hash."""
+    entry = impact.get(runtime_key(script_file))
+    if entry is None:  # never measured, so anything may affect it
+        return True
+    for file, info in entry["files"].items():
+        if os.path.realpath(file) in changed if changed is not None else file_digest(file) != info["sha256"]:
+            return True
+    return False
+
+def select_impacted(script_files: list[Path], rev: str):
+    impact = load_cache_file(IMPACT_FILE)
+    changed = git_changed_files(rev) if rev else None
+    selected = [f for f in script_files if is_impacted(f, impact, changed)]
+    if skipped := len(script_files) - len(selected):
+        since = rev if rev else "the last ddcov run"
+        print(f"{skipped} demo{'s' if skipped != 1 else ''} not affected by changes since {since}, skipped")
+    return selected
+
+def save_cache_file(cache_file: Path, updates: dict, indent: int = 1):
+    # nested ddrun calls share the file, so merge with what they saved meanwhile; None removes an entry
+    merged = {k: v for k, v in (load_cache_file(cache_file) | updates).items() if v is not None}
+    CACHE_DIR.mkdir(exist_ok=True)
+    tmp = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.{threading.get_ident()}")
+    tmp.write_text(json.dumps(merged, indent=indent, sort_keys=True), encoding=DEFAULT_TEXT_ENCODING)
+    tmp.replace(cache_file)
+
+def run_scripts(script_files: list[Path], jobs: int, original_dddir, use_cache=False, zygote: str = None, pool=None, show_timing=False, fail_fast=False, record_metrics=False, loaded: dict = None, controls: dict = None, imports: dict = None, profiles: dict = None, save_runtimes=True):
+    """Runs the demos and prints their messages in the order given.
+
+    When loaded is given, the local modules each demo loaded are stored in it by script file.
+    When controls is given, it holds the control of each running demo, for cancel_demo().
+    When imports is given, the import times of each .py and .sh demo are stored in it by script file.
+    When profiles is given, each demo runs under cProfile, its profile is saved next to its output and
+    compared with the accepted one, and its function times and the functions that grew are stored in it.
+    """
+    if profiles is not None:
+        from demo_driven.ddprof import load_profile
+    runtimes = load_cache_file(RUNTIMES_FILE)
+    results = load_cache_file(RESULTS_FILE) if use_cache else {}
+    cached = set(f for f in script_files if use_cache and is_cached(f, results))
+    results_updates = {}
+    manifest = load_cache_file(MANIFEST_FILE)
+    manifest_updates = {}
+
+    def record(key: str, entry: dict):  # saved as each demo finishes, so an interrupted run keeps what it found
+        manifest_updates[key] = entry
+        save_manifest({key: entry})
+
+    def timed_run(script_file: Path):
+        key = runtime_key(script_file)
+        cacheable = use_cache and is_cacheable(script_file)
+        modules = [] if cacheable or loaded is not None else None
+        timing = {}
+        metrics = {} if record_metrics else None
+        digest = {}
+        control = None
+        if controls is not None:
+            control = controls[script_file] = {}
+        import_times = None
+        if imports is not None and script_file.suffix in (".py", ".sh"):
+            import_times = imports[script_file] = []
+        profile_dir = tempfile.mkdtemp(prefix="ddrun-profile-") if profiles is not None else None
+        start = time.perf_counter()
+        try:
+            state, message = run_demo(script_file, modules, zygote, pool, timing, fail_fast, metrics, control, digest, import_times, profile_dir)
+            elapsed = time.perf_counter() - start
+            stats = load_profile(profile_dir) if profile_dir is not None else None
+        except DemoCancelled:
+            return "cancelled", f"{demo_label(script_file)}: cancelled, its inputs changed while it ran", None, None, timing
+        except Exception:
+            record(key, manifest_entry(manifest.get(key), "failed"))
+            raise
+        finally:
+            if controls is not None:
+                controls.pop(script_file, None)
+            if profile_dir is not None:
+                shutil.rmtree(profile_dir, ignore_errors=True)
+        if loaded is not None:
+            loaded[script_file] = modules
+        regression = None
+        if metrics and "returncode" in metrics:  # a demo stopped by --fail-fast has no metrics
+            regression = save_metrics(script_file, metrics | {"wall": elapsed})
+            message = "\n".join(filter(None, [message, regression]))
+        grown = None
+        if stats is not None:
+            times, growth, grown = save_profile(script_file, stats)
+            profiles[script_file] = times, growth
+            message = "\n".join(filter(None, [message, grown]))
+        record(key, manifest_entry(manifest.get(key), state, digest.get("sha256"), elapsed, regression is not None, grown is not None))
+        return state, message, elapsed, modules if cacheable else None, timing
+
+    def report(script_file: Path, ran):
+        state, message, elapsed, modules, timing = ran
+        if elapsed is not None:
+            runtimes[runtime_key(script_file)] = elapsed
+        print(message)
+        if show_timing and timing:
+            print(f"{demo_label(script_file)}: kernel {timing['kernel']:.2f}s, cells {timing['cells']:.2f}s")
+        if use_cache:  # only a run confirmed to match its baseline may be skipped next time
+            fingerprint = demo_fingerprint(script_file, modules) if modules is not None and state == "matched" else None
+            results_updates[runtime_key(script_file)] = fingerprint and {"fingerprint": fingerprint, "modules": modules}
+
+    def report_cached(script_file: Path):
+        print(f"{demo_label(script_file)}: output matches saved result (cached)")
+
+    if jobs <= 1:
+        try:
+            for script_file in script_files:
+                if script_file in cached:
+                    report_cached(script_file)
+                    continue
+                report(script_file, timed_run(script_file))
+                restore_target_dir_config(original_dddir)
+        finally:
+            if save_runtimes:
+                save_cache_file(RUNTIMES_FILE, runtimes)
+            if use_cache:
+                save_cache_file(RESULTS_FILE, results_updates)
+        return manifest_updates
+
+    # demos that call ddrun -d themselves share .dddir, so they must not overlap
+    serial = set(f for pattern in ini_serial_patterns() for f in match_pattern(pattern, script_files))
+    serial_lock = threading.Lock()
+
+    def serialized_run(script_file: Path):
+        with serial_lock:
+            try:
+                return timed_run(script_file)
+            finally:
+                restore_target_dir_config(original_dddir)
+
+    from concurrent.futures import ThreadPoolExecutor  # only parallel runs need it
+    # longest first; demos without recorded runtime may be long, so they go first too
+    pending = [f for f in script_files if f not in cached]
+    longest_first = sorted(pending, key=lambda f: runtimes.get(runtime_key(f), float("inf")), reverse=True)
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        futures = {f: executor.submit(serialized_run if f in serial else timed_run, f) for f in longest_first}
+        # each worker writes only its own demo's triplet; messages are printed here in glob_sorted order
+        for script_file in script_files:
+            if script_file in cached:
+                report_cached(script_file)
+            else:
+                report(script_file, futures[script_file].result())
+    finally:
+        executor.shutdown(cancel_futures=True)
+        restore_target_dir_config(original_dddir)
+        if save_runtimes:
+            save_cache_file(RUNTIMES_FILE, runtimes)
+        if use_cache:
+            save_cache_file(RESULTS_FILE, results_updates)
+    return manifest_updates
+
+def shard_spec(spec: str):
+    """Parses --shard I/N into (I, N)."""
+    index, _, count = spec.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        index = count = 0
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"expected I/N with 1 <= I <= N, got {spec}")
+    return index, count
+
+def shard_scripts(script_files: list[Path], shard: tuple[int, int]):
+    """The demos of shard I of N, in their usual order.
+
+    Demos with a recorded runtime are dealt out longest first, each to the shard with the least work so far.
+    Demos without one are placed by a hash of their path, counting the median runtime. Every shard computes
+    the same partition as long as they all see the same .ddcache/runtimes.json, which is why shard runs
+    leave it as it is.
+    """
+    import statistics
+    index, count = shard
+    runtimes = load_cache_file(RUNTIMES_FILE)
+    known = [f for f in script_files if runtime_key(f) in runtimes]
+    estimate = statistics.median(runtimes[runtime_key(f)] for f in known) if known else 1.0
+    loads = [0.0] * count
+    assigned = {}
+    for script_file in script_files:
+        if runtime_key(script_file) not in runtimes:
+            n = int.from_bytes(hashlib.sha256(runtime_key(script_file).encode()).digest()[:8], "big") % count
+            assigned[script_file] = n
+            loads[n] += estimate
+    for script_file in sorted(known, key=lambda f: (-runtimes[runtime_key(f)], runtime_key(f))):
+        n = min(range(count), key=lambda i: (loads[i], i))
+        assigned[script_file] = n
+        loads[n] += runtimes[runtime_key(script_file)]
+    return [f for f in script_files if assigned[f] == index - 1]
+
+def demo_result(script_file: Path, state: str, runtime: float = None, **details):
+    """One demo's entry in a --results file."""
+    result = {"state": state, "runtime": runtime} | details
+    if (html_file := script_file.with_name(script_file.name + ".html")).exists() and state in ("changed", "mismatched"):
+        result["diff"] = html_file.as_posix()
+    return result
+
+def shard_assignment(discovered: list[Path], assigned: list[Path]):
+    """What ddmerge needs to check that the shards of a run took every demo exactly once."""
+    return {"discovered": [runtime_key(f) for f in discovered], "assigned": [runtime_key(f) for f in assigned]}
+
+def save_run_results(tool: str, shard: tuple, results_file: str, demos: dict, started: float, **extra):
+    """Writes the results of a ddrun, ddnbo or ddcov run as JSON, for ddmerge to combine."""
+    if results_file is None:
+        results_file = f"{tool}-shard-{shard[0]}-of-{shard[1]}.json"
+    report = {"tool": tool, "shard": f"{shard[0]}/{shard[1]}" if shard else None, "seconds": round(time.perf_counter() - started, 3), "demos": demos} | extra
+    Path(results_file).write_text(json.dumps(report, indent=1), encoding=DEFAULT_TEXT_ENCODING)
+
+def select_scripts(patterns: list[str], all_script_files: list[Path], report_missing=False):
+    if not patterns:
+        return all_script_files
+    selected = []
+    for pattern in patterns:
+        if matched := match_pattern(pattern, all_script_files):
+            selected.extend(f for f in matched if f not in selected)
+        elif report_missing:
+            print(f"{pattern}: not found")
+    return selected
+
+def demo_inputs(script_file: Path, modules: list, results: dict, impact: dict):
+    """Files whose change re-runs the demo: itself, the local modules it loaded, and what ddcov saw it run."""
+    inputs = {os.path.realpath(script_file)}
+    if not modules and (entry := results.get(runtime_key(script_file))):
+        modules = entry["modules"]
+    inputs.update(file for file in modules or [] if file)
+    if entry := impact.get(runtime_key(script_file)):
+        inputs.update(os.path.realpath(file) for file in entry["files"])
+    return inputs
+
+def watch_scripts(patterns: list[str], jobs: int, use_zygote=False, pool_size=0, **options):
+    """Runs the selected demos, then re-runs those whose inputs change, until interrupted.
+
+    A batch runs at a time; a running demo whose inputs change again is cancelled and runs in the next batch.
+    The zygote and kernel pool are started for each batch, so that they never hold modules that have changed.
+    """
+    from demo_driven.watcher import watch_changes
+
+    config_files = {os.path.realpath(TARGET_DIR_FILE), os.path.realpath(INI_FILE)}
+    condition = threading.Condition()
+    pending = set()  # demos to run in the next batch
+    controls = {}  # running demos
+    inputs = {}  # demo -> files it depends on, from its last run
+    config_changed = False
+    config = original_dddir = demo_dir = script_files = None
+
+    def read_config():
+        return load_target_dir_config(), INI_FILE.read_bytes() if INI_FILE.exists() else None
+
+    def load_config(current_config):
+        nonlocal config, original_dddir, demo_dir, script_files
+        config = current_config
+        (original_dddir, demo_dir), _ = config
+        reload_demo_driven_ini()
+        script_files = select_scripts(patterns, glob_sorted(demo_dir), report_missing=True)
+        inputs.clear()
+        pending.update(script_files)
+
+    def modified_since(files: set, since: float):
+        # inputs are known, and their directories watched, only once a demo has run
+        for file in files:
+            try:
+                if os.stat(file).st_mtime > since:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def demo_directories():
+        return {os.path.realpath(demo_dir)} | {os.path.dirname(os.path.realpath(f)) for f in script_files}
+
+    def directories():
+        with condition:
+            return {os.path.realpath(os.getcwd())} | demo_directories() | {os.path.dirname(file) for files in inputs.values() for file in files}
+
+    def watch():
+        nonlocal config_changed, script_files
+        for changed in watch_changes(directories):
+            with condition:
+                if changed & config_files:
+                    config_changed = True
+                watched_demo_dirs = demo_directories()
+                if any(os.path.dirname(path) in watched_demo_dirs for path in changed):  # demos may have been added or removed
+                    script_files = select_scripts(patterns, glob_sorted(demo_dir))
+                for script_file in script_files:
+                    if inputs.get(script_file, {os.path.realpath(script_file)}) & changed:
+                        pending.add(script_file)
+                for script_file, control in list(controls.items()):
+                    if script_file in pending or script_file not in script_files:
+                        cancel_demo(control)
+                condition.notify()
+
+    load_config(read_config())
+    threading.Thread(target=watch, daemon=True).start()
+    try:
+        while True:
+            with condition:
+                while not (pending or config_changed):
+                    condition.wait()
+                if config_changed:  # checked between batches, as nested demos change .dddir while they run
+                    config_changed = False
+                    if (current_config := read_config()) != config:
+                        print(f'Configuration changed, running all demos in "{current_config[0][1]}"')
+                        load_config(current_config)
+                batch = [f for f in script_files if f in pending]
+                pending.clear()
+            if not batch:
+                continue
+            loaded = {}
+            started = time.time()
+            with (
+                start_zygote(ini_preload_option("modules")) if use_zygote else nullcontext() as zygote,
+                kernel_pool(pool_size) as pool
+            ):
+                run_scripts(batch, jobs, original_dddir, zygote=zygote, pool=pool, loaded=loaded, controls=controls, **options)
+            results, impact = load_cache_file(RESULTS_FILE), load_cache_file(IMPACT_FILE)
+            with condition:
+                for script_file, modules in loaded.items():
+                    inputs[script_file] = demo_inputs(script_file, modules, results, impact)
+                    if modified_since(inputs[script_file], started):
+                        pending.add(script_file)
+                if not pending:
+                    print("Watching for changes, press Ctrl+C to stop", flush=True)
+    except KeyboardInterrupt:
+        with condition:
+            for control in list(controls.values()):
+                cancel_demo(control)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -207,34 +1303,84 @@ def main():
     parser.add_argument("names", nargs="*", help="Run the specified demo scripts, or run all if none are specified")
     parser.add_argument("-d", "--dir", nargs="?", const="", help="Set or show the target directory containing demo scripts")
     parser.add_argument("-a", "--accept", action="store_true", help="Accept the outputs of specified demo scripts, or accept all if none are specified")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Run demo scripts on N parallel workers, longest first (0 means one per CPU)")
+    parser.add_argument("-c", "--cache", action="store_true", help="Skip demo scripts whose code, imported local modules and environment are unchanged since their output last matched")
+    parser.add_argument("-z", "--zygote", action="store_true", help="Fork .py demo scripts from a server that has preloaded the [preload] modules of demo_driven.ini")
+    parser.add_argument("-k", "--kernel-pool", type=int, default=0, metavar="N", help="Run notebooks on up to N reused warm kernels instead of a new kernel each")
+    parser.add_argument("--fail-fast", action="store_true", help="Stop a demo as soon as its output differs from the saved result, keeping the saved files untouched")
+    parser.add_argument("-m", "--metrics", action="store_true", help="Record wall time, CPU time, peak RSS and exit code next to each output, and report demos that exceed the [metrics] tolerance")
+    parser.add_argument("--changed", nargs="?", const="", metavar="REV", help="Run only the demos that ran a file changed since git revision REV, or since the last ddcov run if REV is omitted")
+    parser.add_argument("--timing", action="store_true", help="Show how long each notebook spent starting its kernel and executing cells")
+    parser.add_argument("--profile-imports", type=int, nargs="?", const=20, default=0, metavar="N", help="Trace the imports of .py and .sh demos and report the N slowest modules and demos (default 20)")
+    parser.add_argument("--profile", type=int, nargs="?", const=20, default=0, metavar="N", help="Profile each demo with cProfile, save its stats next to its output, report functions that grew since the accepted profile and the N hottest functions (default 20)")
+    parser.add_argument("--shard", type=shard_spec, metavar="I/N", help="Run only the I-th of N parts of the demos, balanced by recorded runtimes, and write its results for ddmerge")
+    parser.add_argument("--results", metavar="FILE", help="Write the state, runtime and diff of each demo as JSON (default with --shard: ddrun-shard-I-of-N.json)")
+    parser.add_argument("-s", "--status", action="store_true", help="Show the state of each demo as of its last run, without running anything")
+    parser.add_argument("-w", "--watch", action="store_true", help="Keep running, and re-run the demos whose code or imported local modules change")
     args = parser.parse_args()
+    jobs = args.jobs or os.cpu_count() or 1
 
     original_dddir, demo_dir = load_target_dir_config()
 
     if args.dir is not None:
         return set_or_show_target_dir(demo_dir, args.dir, bool(args.names))
 
-    all_script_files = glob_sorted(demo_dir)
-    if args.names:
-        for pattern in args.names:
-            if matched := match_pattern(pattern, all_script_files):
-                if args.accept:
-                    for script_file in matched:
-                        accept_script(script_file)
+    if args.status:
+        return show_status(select_scripts(args.names, glob_sorted(demo_dir), report_missing=True))
+
+    if args.watch and not args.accept:
+        return watch_scripts(args.names, jobs, use_zygote=args.zygote, pool_size=args.kernel_pool, use_cache=args.cache, show_timing=args.timing, fail_fast=args.fail_fast, record_metrics=args.metrics)
+
+    discovered = all_script_files = glob_sorted(demo_dir)
+    if args.shard:
+        all_script_files = shard_scripts(all_script_files, args.shard)
+    running = not args.accept
+    started = time.perf_counter()
+    demo_results = {}
+    imports = {} if args.profile_imports and running else None
+    profiles = {} if args.profile and running else None
+    if profiles is not None:
+        from demo_driven.ddprof import profile_shims, profile_report
+    with (
+        profile_shims() if profiles is not None else nullcontext(),  # first, so that pooled kernels inherit the shims
+        start_zygote(ini_preload_option("modules")) if args.zygote and running else nullcontext() as zygote,
+        kernel_pool(args.kernel_pool if running else 0) as pool
+    ):
+        def run(script_files: list[Path]):
+            if args.changed is not None:
+                script_files = select_impacted(script_files, args.changed)
+            updates = run_scripts(script_files, jobs, original_dddir, use_cache=args.cache, zygote=zygote, pool=pool, show_timing=args.timing, fail_fast=args.fail_fast, record_metrics=args.metrics, imports=imports, profiles=profiles, save_runtimes=not args.shard)
+            for script_file in script_files:
+                if entry := updates.get(runtime_key(script_file)):
+                    details = {flag: True for flag in ("metrics_exceeded", "profile_grew") if entry.get(flag)}
+                    demo_results[runtime_key(script_file)] = demo_result(script_file, entry["state"], entry.get("runtime"), **details)
+                else:  # skipped by --cache
+                    demo_results[runtime_key(script_file)] = demo_result(script_file, "matched", cached=True)
+
+        if args.names and not args.accept and jobs > 1:
+            run(select_scripts(args.names, all_script_files, report_missing=True))
+        elif args.names:
+            for pattern in args.names:
+                if matched := match_pattern(pattern, all_script_files):
+                    if args.accept:
+                        accept_scripts(matched)
+                    else:
+                        run(matched)
                 else:
-                    for script_file in matched:
-                        run_script(script_file)
-                        restore_target_dir_config(original_dddir)
-            else:
-                print(f"{pattern}: not found")
-    else:
-        if args.accept:
-            for script_file in all_script_files:
-                accept_script(script_file)
+                    print(f"{pattern}: not found")
         else:
-            for script_file in all_script_files:
-                run_script(script_file)
-                restore_target_dir_config(original_dddir)
+            if args.accept:
+                accept_scripts(all_script_files, pending_only=True)
+            else:
+                run(all_script_files)
+    if imports:
+        from demo_driven.importtime import import_report
+        print("\n".join(import_report({demo_label(f): records for f, records in imports.items()}, args.profile_imports)))
+    if profiles:
+        print("\n".join(profile_report(profiles, args.profile)))
+    if running and (args.shard or args.results):
+        assignment = shard_assignment(discovered, all_script_files) if args.shard else {}
+        save_run_results("ddrun", args.shard, args.results, demo_results, started, **assignment)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,65 @@
+"""Finds demo files under a directory with os.scandir, optionally recursively.
+
+The listing of each directory can be kept in an index and is reused as long as the directory's
+mtime is unchanged, which is the case until an entry is added, removed or renamed in it. So only
+one stat per directory is needed to rediscover a large tree that has not changed.
+"""
+import os
+import re
+import time
+import fnmatch
+from functools import lru_cache
+
+RECENT_NS = 2_000_000_000  # mtimes are coarse on some filesystems, so recently modified directories are listed again
+
+@lru_cache(maxsize=256)
+def compile_patterns(patterns: tuple[str, ...]):
+    """One matcher for all the fnmatch patterns, case-insensitive where the filesystem is; None if there are none."""
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(os.path.normcase(pattern)) for pattern in patterns)).match
+
+def list_directory(path: str, suffixes: tuple[str, ...], cached: list, now_ns: int):
+    """[mtime_ns, file names with one of the suffixes, subdirectory names], reusing cached if it is still valid."""
+    mtime_ns = os.stat(path).st_mtime_ns
+    if cached and cached[0] == mtime_ns:
+        return cached
+    files, subdirs = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            elif os.path.splitext(entry.name)[1] in suffixes:
+                files.append(entry.name)
+    return [mtime_ns if now_ns - mtime_ns > RECENT_NS else None, sorted(files), sorted(subdirs)]
+
+def scan_tree(root: str, suffixes: tuple[str, ...], recursive=False, ignore=(), ignore_dirs=(), index: dict = None):
+    """Returns the paths of the demo files relative to root, and the index of the directories that were visited.
+
+    Files and directories whose name or relative path matches an ignore pattern are skipped;
+    ignore_dirs apply to directories only.
+    """
+    ignored = compile_patterns(tuple(ignore))
+    ignored_dir = compile_patterns(tuple(ignore) + tuple(ignore_dirs))
+    index = index or {}
+    visited = {}
+    found = []
+    now_ns = time.time_ns()
+    pending = [""]
+    while pending:
+        rel = pending.pop()
+        try:
+            listing = visited[rel] = list_directory(os.path.join(root, rel), suffixes, index.get(rel), now_ns)
+        except OSError:
+            continue
+        _, files, subdirs = listing
+        for name in files:
+            path = f"{rel}/{name}" if rel else name
+            if not (ignored and (ignored(os.path.normcase(name)) or ignored(os.path.normcase(path)))):
+                found.append(path)
+        if recursive:
+            for name in reversed(subdirs):
+                path = f"{rel}/{name}" if rel else name
+                if not (ignored_dir and (ignored_dir(os.path.normcase(name)) or ignored_dir(os.path.normcase(path)))):
+                    pending.append(path)
+    return found, visited
@@ -0,0 +1,60 @@
+"""Collects the import times that Python reports with PYTHONPROFILEIMPORTTIME, and ranks the modules.
+
+The variable is inherited by every interpreter a demo starts, including those of shell demos.
+Each interpreter writes a line per import to its stderr, which is merged into the demo's output,
+so these lines are taken out of the output before it is saved. A line may arrive in the middle
+of a line of stdout that was not flushed yet; the two parts of that line are joined again.
+"""
+import re
+
+IMPORT_TIME_ENV = {"PYTHONPROFILEIMPORTTIME": "1"}
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(?:(\d+) \|\s+(\d+) \| ( *)(.+)|self \[us\].*)\n\Z")
+
+def strip_import_times(lines, records: list):
+    """Yields the lines without import times, appending (module, self us, cumulative us, depth) to records."""
+    pending = ""
+    for line in lines:
+        if m := IMPORT_TIME_LINE.search(line):
+            if m[1] is not None:
+                records.append((m[4], int(m[1]), int(m[2]), len(m[3]) // 2))
+            pending += line[:m.start()]
+            continue
+        yield pending + line
+        pending = ""
+    if pending:
+        yield pending
+
+def import_totals(records: list):
+    """Self and cumulative microseconds per module, and the time spent importing, summed over interpreters."""
+    modules = {}
+    total = 0
+    for module, self_us, cumulative_us, depth in records:
+        times = modules.setdefault(module, [0, 0])
+        times[0] += self_us
+        times[1] += cumulative_us
+        if depth == 0:
+            total += cumulative_us
+    return modules, total
+
+def import_report(imports: dict, top: int):
+    """Lines of a report of the slowest modules over all demos, and of the demos that spend longest importing.
+
+    imports holds the records of strip_import_times by name of demo.
+    """
+    modules = {}
+    demos = []
+    for name, records in imports.items():
+        totals, total = import_totals(records)
+        demos.append((total, name))
+        for module, (self_us, cumulative_us) in totals.items():
+            entry = modules.setdefault(module, [0, 0, 0])
+            entry[0] += self_us
+            entry[1] += cumulative_us
+            entry[2] += 1
+    lines = [f"Slowest imports of {len(imports)} demos:", f"{'cumulative':>12} {'self':>10} {'demos':>6}  module"]
+    for module, (self_us, cumulative_us, count) in sorted(modules.items(), key=lambda item: -item[1][1])[:top]:
+        lines.append(f"{cumulative_us / 1000:10.1f}ms {self_us / 1000:8.1f}ms {count:6}  {module}")
+    lines.append("Import time per demo:")
+    for total, name in sorted(demos, reverse=True)[:top]:
+        lines.append(f"{total / 1000:10.1f}ms  {name}")
+    return lines
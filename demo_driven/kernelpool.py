@@ -0,0 +1,72 @@
+import os
+import threading
+import nbformat
+from nbclient import NotebookClient
+from nbclient.util import run_sync
+
+def kernel_name(nb):
+    return nb.metadata.get("kernelspec", {}).get("name", "")
+
+def needs_isolation(nb):
+    """Notebooks opt out of the pool with {"demo_driven": {"isolated": true}} in their metadata."""
+    return bool(nb.metadata.get("demo_driven", {}).get("isolated", False))
+
+class KernelPool:
+    """Warm kernels that notebooks lease, and that are given a clean namespace when returned."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.cwd = os.getcwd()
+        self.idle = {}  # kernel name -> idle kernel managers
+        self.lock = threading.Lock()
+
+    def lease(self, nb):
+        with self.lock:
+            idle = self.idle.get(kernel_name(nb), [])
+            if idle:
+                return idle.pop()
+        client = NotebookClient(nb)
+        km = client.create_kernel_manager()
+        client.start_new_kernel()
+        return km
+
+    def release(self, nb, km):
+        if run_sync(km.is_alive)() and self.reset(km):
+            with self.lock:
+                idle = self.idle.setdefault(kernel_name(nb), [])
+                if len(idle) < self.size:
+                    idle.append(km)
+                    return
+        self.shutdown(km)
+
+    def reset(self, km):
+        # modules stay imported, which is what makes the kernel warm; names, outputs and cwd are cleared
+        source = f"%reset -f\n__import__('os').chdir({self.cwd!r})"
+        client = NotebookClient(nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell(source)]), km=km)
+        try:
+            client.execute()
+            return True
+        except Exception:
+            return False
+        finally:
+            if client.kc is not None:
+                client.kc.stop_channels()
+
+    def shutdown(self, km):
+        try:
+            run_sync(km.shutdown_kernel)(now=True)
+        except RuntimeError:
+            pass
+
+    def close(self):
+        with self.lock:
+            kms = [km for idle in self.idle.values() for km in idle]
+            self.idle.clear()
+        for km in kms:
+            self.shutdown(km)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
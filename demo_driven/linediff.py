@@ -0,0 +1,274 @@
+"""Line diff that stays fast on large outputs, and the compact .html report built from it.
+
+Common prefix and suffix are trimmed first, lines that occur once on both sides anchor the
+rest (patience diff), and what lies between anchors is diffed with Myers' algorithm. Opcodes
+have the same form as those of difflib.SequenceMatcher.get_opcodes().
+"""
+import html
+import difflib
+from bisect import bisect_left
+
+MAX_EDIT_DISTANCE = 500  # a region needing more edits than this is reported as replaced as a whole
+INLINE_DIFF_LENGTH = 1000  # longer changed lines are not highlighted character by character
+
+def intern_lines(a: list[str], b: list[str]):
+    """Replaces lines by small integers, so that comparing and hashing them is cheap."""
+    ids = {}
+    return [ids.setdefault(line, len(ids)) for line in a], [ids.setdefault(line, len(ids)) for line in b]
+
+def unique_anchors(a, b, alo, ahi, blo, bhi):
+    """Longest increasing run of the lines that occur exactly once in a[alo:ahi] and in b[blo:bhi]."""
+    count = {}
+    for i in range(alo, ahi):
+        count[a[i]] = count.get(a[i], 0) + 1
+    in_a = {a[i]: i for i in range(alo, ahi) if count[a[i]] == 1}
+    count = {}
+    for j in range(blo, bhi):
+        count[b[j]] = count.get(b[j], 0) + 1
+    pairs = sorted((in_a[b[j]], j) for j in range(blo, bhi) if count[b[j]] == 1 and b[j] in in_a)
+    # patience sorting on the b positions, with back links to recover the sequence
+    tops, top_index, back = [], [], []
+    for n, (i, j) in enumerate(pairs):
+        pile = bisect_left(tops, j)
+        back.append(top_index[pile - 1] if pile else None)
+        if pile == len(tops):
+            tops.append(j)
+            top_index.append(n)
+        else:
+            tops[pile] = j
+            top_index[pile] = n
+    anchors = []
+    n = top_index[-1] if top_index else None
+    while n is not None:
+        anchors.append(pairs[n])
+        n = back[n]
+    return anchors[::-1]
+
+def myers_blocks(a, b, alo, ahi, blo, bhi, limit=MAX_EDIT_DISTANCE):
+    """Matching blocks of a shortest edit script, or None if it needs more than limit edits."""
+    n, m = ahi - alo, bhi - blo
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, limit) + 1):
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            x = v[k + 1] if k == -d or (k != d and v[k - 1] < v[k + 1]) else v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return myers_backtrack(trace, n, m, alo, blo)
+    return None
+
+def myers_backtrack(trace, x, y, alo, blo):
+    blocks = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        prev_k = k + 1 if k == -d or (k != d and v[k - 1] < v[k + 1]) else k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        size = min(x - prev_x, y - prev_y)
+        if size > 0:
+            blocks.append((alo + x - size, blo + y - size, size))
+        x, y = prev_x, prev_y
+    return blocks[::-1]
+
+def matching_blocks(a: list, b: list):
+    """Non-overlapping (i, j, size) runs with a[i:i+size] == b[j:j+size], in increasing order."""
+    blocks = []
+    pending = [(0, len(a), 0, len(b))]  # ranges to diff and blocks to emit, last one first
+    while pending:
+        task = pending.pop()
+        if len(task) == 3:
+            blocks.append(task)
+            continue
+        alo, ahi, blo, bhi = task
+        i, j = alo, blo
+        while i < ahi and j < bhi and a[i] == b[j]:
+            i += 1
+            j += 1
+        k, l = ahi, bhi
+        while k > i and l > j and a[k - 1] == b[l - 1]:
+            k -= 1
+            l -= 1
+        middle = []
+        if i < k and j < l:
+            if anchors := unique_anchors(a, b, i, k, j, l):
+                ai, bj = i, j
+                for anchor_i, anchor_j in anchors:
+                    middle += [(ai, anchor_i, bj, anchor_j), (anchor_i, anchor_j, 1)]
+                    ai, bj = anchor_i + 1, anchor_j + 1
+                middle.append((ai, k, bj, l))
+            else:
+                middle = myers_blocks(a, b, i, k, j, l) or []
+        tasks = ([(alo, blo, i - alo)] if i > alo else []) + middle + ([(k, l, ahi - k)] if k < ahi else [])
+        pending.extend(reversed(tasks))
+    merged = []
+    for i, j, size in blocks:
+        if merged and merged[-1][0] + merged[-1][2] == i and merged[-1][1] + merged[-1][2] == j:
+            merged[-1] = (merged[-1][0], merged[-1][1], merged[-1][2] + size)
+        else:
+            merged.append((i, j, size))
+    return merged
+
+def get_opcodes(a: list[str], b: list[str]):
+    a_ids, b_ids = intern_lines(a, b)
+    opcodes = []
+    i = j = 0
+    for ai, bj, size in matching_blocks(a_ids, b_ids) + [(len(a), len(b), 0)]:
+        if i < ai and j < bj:
+            opcodes.append(("replace", i, ai, j, bj))
+        elif i < ai:
+            opcodes.append(("delete", i, ai, j, bj))
+        elif j < bj:
+            opcodes.append(("insert", i, ai, j, bj))
+        if size:
+            opcodes.append(("equal", ai, ai + size, bj, bj + size))
+        i, j = ai + size, bj + size
+    return opcodes
+
+def grouped_opcodes(opcodes, context=3):
+    """Splits the opcodes into hunks with up to context unchanged lines around each change."""
+    group = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag != "equal":
+            group.append((tag, i1, i2, j1, j2))
+            continue
+        if group:
+            if i2 - i1 <= 2 * context:
+                group.append((tag, i1, i2, j1, j2))
+                continue
+            group.append((tag, i1, i1 + context, j1, j1 + context))
+            yield group
+        group = [(tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2)]
+    if group and any(tag != "equal" for tag, *_ in group):
+        if group[0][0] == "equal" and group[0][1] == group[0][2]:
+            group.pop(0)
+        yield group
+
+def hunk_header(group):
+    def span(lo, hi):
+        return f"{lo + 1 if hi > lo else lo},{hi - lo}"
+    return f"@@ -{span(group[0][1], group[-1][2])} +{span(group[0][3], group[-1][4])} @@"
+
+def unified_diff(a: list[str], b: list[str], fromfile: str, tofile: str, hunks):
+    yield f"--- {fromfile}"
+    yield f"+++ {tofile}"
+    for group in hunks:
+        yield hunk_header(group)
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                yield from (" " + line for line in a[i1:i2])
+                continue
+            yield from ("-" + line for line in a[i1:i2])
+            yield from ("+" + line for line in b[j1:j2])
+
+def highlight_changes(old: str, new: str):
+    if len(old) > INLINE_DIFF_LENGTH or len(new) > INLINE_DIFF_LENGTH:
+        return html.escape(old), html.escape(new)
+    old_html, new_html = [], []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old, new, autojunk=False).get_opcodes():
+        if tag == "equal":
+            old_html.append(html.escape(old[i1:i2]))
+            new_html.append(html.escape(new[j1:j2]))
+        else:
+            old_html.append(f'<span class="chg">{html.escape(old[i1:i2])}</span>' if i2 > i1 else "")
+            new_html.append(f'<span class="chg">{html.escape(new[j1:j2])}</span>' if j2 > j1 else "")
+    return "".join(old_html), "".join(new_html)
+
+def html_rows(a: list[str], b: list[str], hunks):
+    def row(cls, i, old, j, new):
+        old_no = "" if i is None else i + 1
+        new_no = "" if j is None else j + 1
+        return f'<tr class="{cls}"><td class="no">{old_no}</td><td>{old}</td><td class="no">{new_no}</td><td>{new}</td></tr>'
+
+    def fold(count):
+        return f'<tr class="fold"><td colspan="4">&#8943; {count} unchanged line{"s" if count != 1 else ""}</td></tr>'
+
+    shown = 0  # lines of a before this point are shown or folded
+    for group in hunks:
+        if group[0][1] > shown:
+            yield fold(group[0][1] - shown)
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                for i, j in zip(range(i1, i2), range(j1, j2)):
+                    text = html.escape(a[i])
+                    yield row("eq", i, text, j, text)
+                continue
+            for n in range(max(i2 - i1, j2 - j1)):
+                i = i1 + n if i1 + n < i2 else None
+                j = j1 + n if j1 + n < j2 else None
+                if i is not None and j is not None:
+                    old, new = highlight_changes(a[i], b[j])
+                    yield row("chg", i, old, j, new)
+                elif i is not None:
+                    yield row("del", i, html.escape(a[i]), None, "")
+                else:
+                    yield row("ins", None, "", j, html.escape(b[j]))
+        shown = group[-1][2]
+    if len(a) > shown:
+        yield fold(len(a) - shown)
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; }}
+table {{ border-collapse: collapse; font-family: monospace; white-space: pre-wrap; width: 100%; }}
+th {{ text-align: left; background: #eee; padding: 2px 6px; }}
+td {{ padding: 0 6px; vertical-align: top; width: 50%; }}
+td.no {{ color: #888; text-align: right; width: 1%; white-space: nowrap; }}
+tr.del td:nth-child(2), tr.chg td:nth-child(2) {{ background: #fdd; }}
+tr.ins td:nth-child(4), tr.chg td:nth-child(4) {{ background: #dfd; }}
+span.chg {{ background: #fb5; }}
+tr.fold td {{ background: #eef; color: #666; text-align: center; font-family: sans-serif; padding: 2px; }}
+</style>
+</head>
+<body>
+<p>{summary}</p>
+{body}
+</body>
+</html>
+"""
+
+def make_html(a: list[str], b: list[str], fromdesc: str, todesc: str, context=3, max_size=10_000_000):
+    """Side-by-side report of the changed hunks with unchanged regions folded.
+
+    If that report would be larger than max_size characters, a unified diff is shown instead,
+    cut off at max_size as well.
+    """
+    opcodes = get_opcodes(a, b)
+    hunks = list(grouped_opcodes(opcodes, context))
+    removed = sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag != "equal")
+    added = sum(j2 - j1 for tag, _, _, j1, j2 in opcodes if tag != "equal")
+    summary = f"{removed} line{'s' if removed != 1 else ''} removed, {added} added, in {len(hunks)} hunk{'s' if len(hunks) != 1 else ''}"
+    if not hunks:
+        summary = "No line differs; the outputs differ only in their line breaks or final newline"
+    title = html.escape(f"{fromdesc} vs {todesc}")
+
+    rows, size = [], 0
+    for row in html_rows(a, b, hunks):
+        rows.append(row)
+        size += len(row) + 1
+        if size > max_size:
+            break
+    else:
+        header = f"<tr><th></th><th>{html.escape(fromdesc)}</th><th></th><th>{html.escape(todesc)}</th></tr>"
+        body = "<table>\n" + "\n".join([header] + rows) + "\n</table>"
+        return HTML_TEMPLATE.format(title=title, summary=html.escape(summary), body=body)
+
+    lines, size = [], 0
+    for line in unified_diff(a, b, fromdesc, todesc, hunks):
+        size += len(line) + 1
+        if size > max_size:
+            lines.append(f"... diff truncated at {max_size} characters")
+            break
+        lines.append(line)
+    summary += "; too large for a side-by-side view, shown as a unified diff"
+    body = "<pre>" + html.escape("\n".join(lines)) + "</pre>"
+    return HTML_TEMPLATE.format(title=title, summary=html.escape(summary), body=body)
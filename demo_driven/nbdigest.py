@@ -0,0 +1,86 @@
+"""Digests of notebook cell outputs, for comparing cells without building the text of their outputs.
+
+Each output is reduced to (kind, sha256) pairs in one pass. A kind is a mime type, or stdout,
+stderr or error for streams and tracebacks. What goes into a digest depends on the policy of
+its kind:
+
+    compare  the text, normalized line by line as it is hashed, or the bytes of binary data
+             such as images, decoded from base64; data of another type that is not valid
+             base64 is compared as text
+    hash     the data exactly as stored in the notebook
+    ignore   nothing; the output is left out of the comparison
+
+Policies are looked up by exact kind first, then by the first fnmatch pattern that matches.
+"""
+import json
+import base64
+import hashlib
+import fnmatch
+
+from demo_driven.normalize import normalize_lines
+
+MIME_POLICIES = ("compare", "hash", "ignore")
+# widget views carry model ids that are new on every run
+DEFAULT_MIME_POLICIES = {"application/vnd.jupyter.widget-view+json": "ignore", "*": "compare"}
+
+def output_policy(kind: str, policies: dict):
+    if kind in policies:
+        return policies[kind]
+    for pattern, policy in policies.items():
+        if fnmatch.fnmatchcase(kind, pattern):
+            return policy
+    return "compare"
+
+def is_text(kind: str):
+    return "/" not in kind or kind.startswith("text/") or kind.endswith(("json", "xml", "javascript"))
+
+def output_items(outputs):
+    """(kind, data) of each output and each of its mime types; consecutive outputs of one stream are joined,
+    because a kernel may split a stream anywhere."""
+    stream, texts = None, []
+    for output in outputs:
+        if output.output_type == "stream" and output.get("name", "stdout") == stream:
+            texts.append(output.text)
+            continue
+        if texts:
+            yield stream, "".join(texts)
+        stream, texts = None, []
+        match output.output_type:
+            case "stream":
+                stream, texts = output.get("name", "stdout"), [output.text]
+            case "execute_result" | "display_data":
+                yield from sorted(output.get("data", {}).items())
+            case "error":
+                yield "error", "\n".join(output.get("traceback", []))
+    if texts:
+        yield stream, "".join(texts)
+
+def text_digest(text: str, normalize=None):
+    h = hashlib.sha256()
+    for line in normalize_lines(text.splitlines(keepends=True), normalize) if normalize else [text]:
+        h.update(line.encode("utf-8"))
+    return h.hexdigest()
+
+def binary_digest(data: str, normalize=None):
+    try:
+        return hashlib.sha256(base64.b64decode("".join(data.split()), validate=True)).hexdigest()
+    except ValueError:  # binascii.Error; a custom mime type stored as plain text
+        return text_digest(data, normalize)
+
+def cell_digests(cell, policies: dict, normalize=None):
+    """[(kind, sha256)] of the cell's outputs, in order."""
+    digests = []
+    for kind, data in output_items(cell.get("outputs", [])):
+        if not isinstance(data, str):  # JSON mime types are stored as objects
+            data = json.dumps(data, sort_keys=True)
+        match output_policy(kind, policies):
+            case "ignore":
+                continue
+            case "hash":
+                digest = hashlib.sha256(data.encode("utf-8")).hexdigest()
+            case _ if is_text(kind):
+                digest = text_digest(data, normalize)
+            case _:
+                digest = binary_digest(data, normalize)
+        digests.append((kind, digest))
+    return digests
@@ -0,0 +1,149 @@
+"""Runs the code cells of a plain Python notebook as a script, without a kernel.
+
+A notebook qualifies when it has no magics or shell commands, does not use names that only
+IPython defines and imports no module that displays through the frontend. Its code cells are
+written into a script that runs them in one namespace, shows the value of a cell's last
+expression the way IPython does, and writes a marker before each cell, its stderr and its
+result, from which the text of each cell's outputs is put back together. What a cell writes to
+stderr follows what it writes to stdout, as a kernel sends them when it flushes both at the
+end of a cell or before its result.
+
+The script exits with FALLBACK_EXIT whenever its output might differ from a kernel's, for
+instance when a cell raises or exits; the notebook must then run on a kernel.
+"""
+import io
+import os
+import re
+import sys
+import ast
+import tokenize
+
+FALLBACK_EXIT = 3
+NEEDS_KERNEL = "# needs a kernel: "
+# names the kernel defines in the user namespace or as builtins, and __file__, which it does not
+IPYTHON_NAMES = re.compile(r"_{1,3}|_i{1,3}|_i?\d+|_[iod]h|In|Out|get_ipython|display|exit|quit|__file__")
+# modules that show their results through the frontend, or that behave differently inside a kernel
+DISPLAY_MODULES = {"IPython", "ipykernel", "ipywidgets", "matplotlib", "seaborn", "plotly", "bokeh", "altair", "tqdm", "asyncio", "nest_asyncio"}
+# of those, the ones that still need a kernel when imported indirectly
+SHOWN_MODULES = {"matplotlib.pyplot", "ipywidgets"}
+
+def cell_reason(source: str, is_magic, assigned: set):  # -> why the cell needs a kernel, or None
+    for line in source.splitlines():
+        if is_magic(line, "python"):
+            return "magic or shell command"
+    try:
+        tree = compile(source, "<cell>", "exec", ast.PyCF_ONLY_AST)
+        compile(tree, "<cell>", "exec")
+    except SyntaxError:
+        return "not plain Python"
+    for node in ast.walk(tree):
+        match node:
+            case ast.Name(id=name, ctx=ast.Store()):
+                assigned.add(name)
+            case ast.Name(id=name) if IPYTHON_NAMES.fullmatch(name) and name not in assigned:
+                return f"uses {name}"
+            case ast.Import(names=aliases) if any(alias.name.partition(".")[0] in DISPLAY_MODULES for alias in aliases):
+                return "imports a display module"
+            case ast.ImportFrom(module=module, level=0) if module.partition(".")[0] in DISPLAY_MODULES:
+                return "imports a display module"
+            case ast.Attribute(value=ast.Name(id="sys"), attr="argv"):
+                return "uses sys.argv"
+    return None
+
+def notebook_script(nb, marker: str, name: str):  # -> script source, or None and why the notebook needs a kernel
+    try:
+        from jupytext.magics import is_magic  # the same test jupytext uses to comment magics out
+    except ImportError:
+        return None, "jupytext is not installed"
+    kernelspec = nb.metadata.get("kernelspec", {})
+    if kernelspec.get("language", "python") != "python" or kernelspec.get("name", "python3") not in ("python3", "python"):
+        return None, f"kernel {kernelspec.get('name')}"
+    sources = []
+    assigned = set()
+    for index, cell in enumerate(c for c in nb.cells if c.cell_type == "code"):
+        if "raises-exception" in cell.metadata.get("tags", []):
+            return None, f"cell [{index + 1}] is expected to raise"
+        if reason := cell_reason(cell.source, is_magic, assigned):
+            return None, f"cell [{index + 1}] {reason}"
+        sources.append(cell.source)
+    cells = "".join(f"    {source!r},\n" for source in sources)
+    return f"# code cells of {name}, run by demo_driven without a kernel\nfrom demo_driven.nbscript import run_cells as __dd_run_cells\n__dd_run_cells({marker!r}, [\n{cells}])\n", None
+
+def cell_outputs(output: str, marker: str, cell_count: int):  # -> text of each cell's outputs, or None if incomplete
+    """Puts the output of a script back together as notebook_cell_output_text would give it per cell."""
+    before, *parts = output.split(marker)
+    cells = []
+    for part in parts:
+        match part[:1]:
+            case "c":
+                cells.append([part[1:], None])
+            case "s" if cells:
+                cells[-1][0] += part[1:]
+            case "r" if cells:
+                cells[-1][1] = part[1:]
+            case "e":  # anything printed after the last cell, e.g. by atexit handlers, a kernel would not show
+                break
+            case _:
+                return None
+    else:
+        return None
+    if before or len(cells) != cell_count:
+        return None
+    # a stream output and the result that follows are of different types, so a newline separates them
+    return [stream + "\n" + result if stream and result is not None else stream + (result or "") for stream, result in cells]
+
+def is_quiet(source: str):
+    """Whether the cell ends with a semicolon, which hides its result in IPython."""
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(source).readline))
+    except (tokenize.TokenError, SyntaxError):
+        return False
+    for token in reversed(tokens):
+        if token.type not in (tokenize.ENDMARKER, tokenize.NL, tokenize.NEWLINE, tokenize.COMMENT):
+            return token.type == tokenize.OP and token.string == ";"
+    return False
+
+def flush_stderr(stderr: io.StringIO, marker: str):
+    if text := stderr.getvalue():
+        sys.stdout.write(marker + "s" + text)
+        stderr.seek(0)
+        stderr.truncate()
+
+def show_result(value, marker: str, formatter: list, stderr: io.StringIO):
+    if value is None:
+        return
+    if hasattr(type(value), "_ipython_display_") or hasattr(type(value), "_repr_mimebundle_"):
+        sys.exit(FALLBACK_EXIT)  # displays itself, maybe with a text/plain of its own
+    if not formatter:
+        from IPython.core.formatters import PlainTextFormatter  # the formatter of text/plain in a kernel
+        formatter.append(PlainTextFormatter())
+    text = formatter[0](value)
+    flush_stderr(stderr, marker)
+    sys.stdout.write(marker + "r" + text)
+
+def run_cells(marker: str, sources: list[str]):
+    sys.path[0] = os.getcwd()  # where a kernel imports from, rather than the cache directory of the script
+    namespace = sys.modules["__main__"].__dict__
+    namespace.pop("__dd_run_cells", None)
+    stderr = sys.stderr = io.StringIO()
+    formatter = []
+    sys.displayhook = lambda value: show_result(value, marker, formatter, stderr)
+    try:
+        for index, source in enumerate(sources, 1):
+            sys.stdout.write(marker + "c")
+            filename = f"<cell {index}>"
+            body = ast.parse(source, filename).body
+            # like IPython, the last statement is run interactively if it is an expression
+            last = body[-1:] if body and isinstance(body[-1], ast.Expr) and not is_quiet(source) else []
+            exec(compile(ast.Module(body[:len(body) - len(last)], type_ignores=[]), filename, "exec"), namespace)
+            if last:
+                exec(compile(ast.Interactive(last), filename, "single"), namespace)
+            flush_stderr(stderr, marker)
+            if SHOWN_MODULES.intersection(sys.modules):
+                sys.exit(FALLBACK_EXIT)
+        sys.stdout.write(marker + "e")
+        sys.stdout.flush()
+    except BaseException:  # including SystemExit, which a kernel shows as an error
+        sys.stdout.flush()
+        sys.stderr = sys.__stderr__
+        sys.exit(FALLBACK_EXIT)
@@ -0,0 +1,61 @@
+"""Masks the parts of demo output that differ from run to run, such as timestamps and addresses.
+
+A rule is a name and a regex; each match is replaced by <name>. All rules of a demo are compiled
+into one alternation, so each line is scanned once however many rules there are. Where several
+rules match at the same position, the one listed first wins. Numbered backreferences such as \\1
+are renumbered to the groups of their own rule in the alternation.
+"""
+import re
+import tempfile
+from functools import lru_cache
+
+BUILTIN_RULES = {
+    "timestamp": r"\d{4}-\d\d-\d\d[T ]\d\d:\d\d:\d\d(?:[.,]\d+)?(?:Z|[+-]\d\d:?\d\d)?",
+    "address": r"\b0x[0-9a-fA-F]{6,}\b",
+    "tmpdir": re.escape(tempfile.gettempdir()) + r"(?:[\\/][^\s'\"]*)?",
+    "duration": r"\b\d+(?:\.\d+)?\s?(?:ns|us|µs|ms|s|sec|seconds)\b",
+}
+
+# a backreference \N or a conditional (?(N)...) outside a character class, or any other token
+GROUP_REF = re.compile(r"\\(?:0[0-7]{0,2}|[0-7]{3}|([1-9]\d?)|.)|\(\?\((\d+)\)|\[\^?\]?|.", re.S)
+CLASS_TOKEN = re.compile(r"\\.|.", re.S)
+
+def shift_group_refs(pattern: str, offset: int):
+    """Adds offset to the group numbers that pattern refers to."""
+    parts, pos, in_class = [], 0, False
+    while pos < len(pattern):
+        m = (CLASS_TOKEN if in_class else GROUP_REF).match(pattern, pos)
+        pos = m.end()
+        if in_class:
+            in_class = m[0] != "]"
+        elif m[0].startswith("["):
+            in_class = True
+        elif group := m.lastindex:
+            if (number := int(m[group]) + offset) > 99:
+                raise re.error(f"too many groups before backreference {m[0]}", pattern)
+            parts.append(pattern[m.start():m.start(group)] + str(number) + pattern[m.end(group):pos])
+            continue
+        parts.append(m[0])
+    return "".join(parts)
+
+@lru_cache(maxsize=64)
+def compile_rules(rules: tuple[tuple[str, str], ...]):
+    """Returns a function that normalizes one line with the (name, regex) rules."""
+    if not rules:
+        return None
+    # each rule is wrapped in a group of its own, which is the last group to close when it matches;
+    # the groups of the rules before it come first, so its own backreferences are shifted past them
+    alternatives, groups = [], 0
+    for i, (_, pattern) in enumerate(rules):
+        alternatives.append(f"(?P<_{i}>{shift_group_refs(pattern, groups + 1)})")
+        groups += 1 + re.compile(pattern).groups
+    matcher = re.compile("|".join(alternatives))
+    replacements = {f"_{i}": f"<{name}>" for i, (name, _) in enumerate(rules)}
+
+    def normalize(line: str):
+        return matcher.sub(lambda m: replacements[m.lastgroup], line)
+    return normalize
+
+def normalize_lines(lines, normalize):
+    for line in lines:
+        yield normalize(line)
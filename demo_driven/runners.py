@@ -0,0 +1,54 @@
+"""The runners of demos, by suffix, imported only when a demo of their suffix runs.
+
+A runner is a function that runs a demo and yields its output in chunks as it is produced:
+
+    def run(script_file: Path, env: dict, metrics: dict = None, control: dict = None, **options)
+
+env is the environment to run the demo in. metrics and control are those of stream_output; a
+runner that starts a process can pass them on to demo_driven.ddrun.stream_process, which fills
+them in. Other options are for the built-in runners, and may grow; a runner ignores those it does
+not know. Built-in runners handle .py, .ipynb and .sh demos. Other packages add runners through
+entry points of the group demo_driven.runners, named by suffix:
+
+    [project.entry-points."demo_driven.runners"]
+    ".R" = "ddrun_r:run"
+
+Demos are discovered by the suffixes registered; demos of the same name are ordered by suffix in
+the order of registration, built-in first. A plugin cannot replace a built-in runner. Finding entry points
+means reading the metadata of every installed package, so the entries found are cached together
+with the modification times of the directories on sys.path, which change when a package is
+installed or removed.
+"""
+import os
+import sys
+import importlib
+
+RUNNER_GROUP = "demo_driven.runners"
+BUILTIN_RUNNERS = {
+    ".py": "demo_driven.ddrun:run_python_demo",
+    ".ipynb": "demo_driven.ddrun:run_notebook_demo",
+    ".sh": "demo_driven.ddrun:run_shell_demo",
+}
+
+def path_stamps():
+    stamps = []
+    for entry in sys.path:
+        try:
+            stamps.append([entry, os.stat(entry or ".").st_mtime_ns])
+        except OSError:
+            stamps.append([entry, None])
+    return stamps
+
+def plugin_runners(cached: dict):  # -> {suffix: entry} of the plugins installed, and what to cache, or None if cached is current
+    if cached.get("paths") == (stamps := path_stamps()):
+        return cached.get("runners", {}), None
+    from importlib.metadata import entry_points
+    runners = {}
+    for entry_point in entry_points(group=RUNNER_GROUP):
+        if entry_point.name not in BUILTIN_RUNNERS:
+            runners.setdefault(entry_point.name, entry_point.value)
+    return runners, {"paths": stamps, "runners": runners}
+
+def load_runner(entry: str):
+    module, _, function = entry.partition(":")
+    return getattr(importlib.import_module(module), function)
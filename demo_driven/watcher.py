@@ -0,0 +1,121 @@
+"""Reports the files that change in a set of directories, through inotify on Linux and by polling elsewhere.
+
+Only the directories themselves are watched, not their subdirectories. Changes are debounced:
+a batch of changed paths is reported once no further change has arrived for a moment.
+"""
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, length of the name that follows
+
+def load_inotify():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+def snapshot(directories: set[str]):
+    """Modification time and size of each file, per directory."""
+    state = {}
+    for directory in directories:
+        files = state[directory] = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat()
+                        files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+    return state
+
+def snapshot_changes(old: dict, new: dict):
+    # a directory watched for the first time has no changes yet
+    changed = set()
+    for directory in old.keys() & new.keys():
+        before, after = old[directory], new[directory]
+        changed.update(path for path in before.keys() | after.keys() if before.get(path) != after.get(path))
+    return changed
+
+def poll_changes(directories, debounce: float, interval: float):
+    state = snapshot(directories())
+    pending = set()
+    while True:
+        time.sleep(debounce if pending else interval)
+        current = snapshot(directories())
+        if changed := snapshot_changes(state, current):
+            pending |= changed
+        elif pending:
+            yield pending
+            pending = set()
+        state = current
+
+def read_events(fd: int):
+    try:
+        data = os.read(fd, 1 << 16)
+    except BlockingIOError:
+        return
+    offset = 0
+    while offset < len(data):
+        wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+        yield wd, mask, os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+        offset += length
+
+def update_watches(libc, fd: int, watches: dict, directories: set[str]):
+    for directory in watches.keys() - directories:
+        libc.inotify_rm_watch(fd, watches.pop(directory))
+    for directory in directories - watches.keys():
+        if (wd := libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK)) >= 0:
+            watches[directory] = wd
+
+def inotify_changes(libc, fd: int, directories, debounce: float, interval: float):
+    watches = {}  # directory -> watch descriptor
+    pending = set()
+    try:
+        while True:
+            # the directories may grow as demos record what they import, so they are asked for again
+            update_watches(libc, fd, watches, directories())
+            if not select.select([fd], [], [], debounce if pending else interval)[0]:
+                if pending:
+                    yield pending
+                    pending = set()
+                continue
+            watched = {wd: directory for directory, wd in watches.items()}
+            for wd, mask, name in read_events(fd):
+                if mask & IN_Q_OVERFLOW:  # events were lost, so anything may have changed
+                    pending.update(path for files in snapshot(set(watches)).values() for path in files)
+                elif mask & IN_IGNORED:  # the directory is gone; it is watched again if it comes back
+                    watches.pop(watched.get(wd), None)
+                elif name and wd in watched:
+                    pending.add(os.path.join(watched[wd], name))
+    finally:
+        os.close(fd)
+
+def watch_changes(directories, debounce=0.2, interval=0.5):
+    """Yields sets of changed paths in the directories, which is a function returning a set of absolute paths."""
+    if (libc := load_inotify()) is not None and (fd := libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)) >= 0:
+        return inotify_changes(libc, fd, directories, debounce, interval)
+    return poll_changes(directories, debounce, interval)
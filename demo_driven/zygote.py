@@ -0,0 +1,100 @@
+"""Fork server that preloads modules once and forks a child per .py demo.
+
+Usage: python -m demo_driven.zygote SOCKET [module ...]
+
+Each request is a JSON object sent over the unix socket together with the
+write end of a pipe. The forked child replies with its pid, makes that pipe
+its stdout and stderr, runs the script as __main__ and replies with its exit
+status and resource usage.
+"""
+import os
+import sys
+import json
+import signal
+import socket
+import atexit
+import importlib
+import threading
+
+from demo_driven.ddexec import record_modules, run_main
+
+REQUEST_SIZE = 1 << 20
+
+def is_supported():
+    return hasattr(os, "fork") and hasattr(socket, "send_fds")
+
+def exit_code(e: SystemExit):
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    print(e.code, file=sys.stderr)
+    return 1
+
+def serve(listener: socket.socket):
+    """Accepts requests forever; returns only in a forked child, with the request it has to run."""
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # children are reaped automatically
+    while True:
+        conn, _ = listener.accept()
+        msg, fds, _, _ = socket.recv_fds(conn, REQUEST_SIZE, 1)
+        if not fds:
+            conn.close()
+            continue
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if os.fork() == 0:
+            listener.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            return conn, json.loads(msg), fds[0]
+        conn.close()
+        os.close(fds[0])
+
+def resource_usage():
+    import resource  # POSIX only, like the rest of the zygote, but this module is imported everywhere
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    peak_rss = max(own.ru_maxrss, children.ru_maxrss) * (1 if sys.platform == "darwin" else 1024)
+    return {"cpu": own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime, "peak_rss": peak_rss}
+
+def run_child(conn: socket.socket, request: dict, output_fd: int):
+    conn.sendall(json.dumps({"pid": os.getpid()}).encode() + b"\n")  # lets the client kill a demo it no longer needs
+    os.dup2(output_fd, 1)
+    os.dup2(output_fd, 2)
+    os.close(output_fd)
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    if modules_file := request.get("record_modules"):
+        atexit.register(record_modules, modules_file)
+    try:
+        run_main(request["script"], request.get("args", []))
+        code = 0
+    except SystemExit as e:
+        code = exit_code(e)
+    # finish the way the interpreter does: wait for threads, run atexit handlers, flush
+    if hasattr(threading, "_shutdown"):
+        threading._shutdown()
+    atexit._run_exitfuncs()
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except Exception:
+            pass
+    conn.sendall(json.dumps({"returncode": code} | resource_usage()).encode() + b"\n")
+    conn.close()
+    os._exit(code)
+
+def main():
+    socket_path, modules = sys.argv[1], sys.argv[2:]
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            print(f"zygote: cannot preload {module}: {e}", file=sys.stderr)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen(64)
+    print("ready", flush=True)
+    run_child(*serve(listener))
+
+if __name__ == "__main__":
+    main()